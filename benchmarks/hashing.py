@@ -0,0 +1,84 @@
+"""
+Micro-benchmark of partition hashing, in keys per second.
+
+`before` is the per-character string hash that `MRServer.partition`
+used to call for every key, `after` is `common.hashing.partition_keys`.
+
+    python -m benchmarks.hashing [--keys 200000] [--partitions 8]
+"""
+import random
+import string
+import time
+from argparse import ArgumentParser
+
+from mapreduce.common.hashing import partition_keys
+
+
+class OldHash:
+    @staticmethod
+    def hash_string(s):
+        if not s:
+            return 0
+        value = ord(s[0]) << 7
+        for char in s:
+            value = OldHash.c_mul(1000003, value) ^ ord(char)
+        value = value ^ len(s)
+        if value == -1:
+            value = -2
+        return value
+
+    @staticmethod
+    def c_mul(a, b):
+        return int(hex((a * b) & 0xFFFFFFFF)[:-1], 16)
+
+    @staticmethod
+    def hash(obj):
+        if isinstance(obj, str):
+            return OldHash.hash_string(obj)
+        else:
+            return obj
+
+
+def old_partition_keys(keys, n):
+    return [OldHash.hash(key) % n for key in keys]
+
+
+def make_keys(kind, size, seed=0):
+    rng = random.Random(seed)
+    if kind == "str":
+        return ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 12)))
+                for _ in range(size)]
+    if kind == "int":
+        return [rng.randint(0, 2 ** 40) for _ in range(size)]
+    if kind == "float":
+        return [rng.random() * 1e6 for _ in range(size)]
+    if kind == "tuple":
+        return [(rng.randint(0, 1000), "k%d" % rng.randint(0, 1000)) for _ in range(size)]
+    raise ValueError(kind)
+
+
+def measure(func, keys, n, chunk=1024):
+    start = time.perf_counter()
+    for i in range(0, len(keys), chunk):
+        func(keys[i:i+chunk], n)
+    return len(keys) / (time.perf_counter() - start)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--keys", type=int, default=200000)
+    parser.add_argument("--partitions", type=int, default=8)
+    args = parser.parse_args()
+    print("%-6s %16s %16s" % ("keys", "before (keys/s)", "after (keys/s)"))
+    for kind in ("str", "int", "float", "tuple"):
+        keys = make_keys(kind, args.keys)
+        try:
+            before = "%16.0f" % measure(old_partition_keys, keys, args.partitions)
+        except TypeError:
+            before = "%16s" % "unsupported"
+        after = measure(partition_keys, keys, args.partitions)
+        print("%-6s %s %16.0f" % (kind, before, after))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark of the start-up latency, in milliseconds.
+
+`import` is the time `import mapreduce` takes in a fresh interpreter,
+`cold` the time a new `MRClient` takes to answer its first command,
+`warm` the same with the processes of a started `WorkerPool`, and
+`reset` the time `MRClient.reset` takes to clear the datasets.
+
+    python -m benchmarks.startup [--processes 4] [--repeat 5] [--methods fork,forkserver,spawn]
+"""
+import os
+import sys
+import time
+import subprocess
+from argparse import ArgumentParser
+
+from mapreduce import MRClient, WorkerPool
+
+IMPORT = "import time; start = time.perf_counter(); import mapreduce; print(time.perf_counter() - start)"
+
+
+def measure_import(repeat):
+    path = [os.getcwd(), os.environ.get("PYTHONPATH")]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, path)))
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", IMPORT], env=env, check=True,
+                                stdout=subprocess.PIPE, universal_newlines=True).stdout
+        times.append(float(output))
+    return min(times)
+
+
+def first_command(client):
+    start = time.perf_counter()
+    client.distribute("startup", list(range(1000))).count()
+    return time.perf_counter() - start
+
+
+def measure_cold(processes, method, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pool = WorkerPool(processes, method)
+        client = MRClient(pool=pool)
+        first_command(client)
+        times.append(time.perf_counter() - start)
+        client.terminate()
+        pool.terminate()
+    return min(times)
+
+
+def measure_warm(processes, method, repeat):
+    pool = WorkerPool(processes, method).start()
+    warm, reset = [], []
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            client = MRClient(pool=pool)
+            first_command(client)
+            warm.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            client.reset()
+            reset.append(time.perf_counter() - start)
+            client.terminate()
+    finally:
+        pool.terminate()
+    return min(warm), min(reset)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--methods", default="fork,forkserver,spawn")
+    args, _ = parser.parse_known_args()
+    print("import %8.1f" % (measure_import(args.repeat) * 1000))
+    print("%-10s %8s %8s %8s" % ("method", "cold", "warm", "reset"))
+    for method in args.methods.split(","):
+        cold = measure_cold(args.processes, method, args.repeat)
+        warm, reset = measure_warm(args.processes, method, args.repeat)
+        print("%-10s %8.1f %8.1f %8.1f" % (method, cold * 1000, warm * 1000, reset * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+Benchmark suite of the common operations, in seconds per run.
+
+Every benchmark prepares its input, which is not timed, and times one
+operation until its result is stored on the processes. The runs use
+fixed seeds, so two runs on the same machine do the same work. The
+results can be saved as JSON, and compared with the results of an
+earlier run to flag the regressions.
+
+    python -m benchmarks.suite [--sizes 100000,1000000] [--processes 1,4]
+                               [--repeat 3] [--only wordcount,collect]
+                               [--output results.json]
+                               [--compare baseline.json] [--threshold 0.2]
+
+The settings, e.g. `--batch_bytes 0`, can be given as well. The exit
+status is 1 if a benchmark is slower than in the baseline by more than
+the threshold.
+"""
+import gc
+import sys
+import json
+import time
+import random
+import platform
+import subprocess
+from operator import add, itemgetter
+from argparse import ArgumentParser
+from statistics import median
+
+from mapreduce.client import MRClient
+from mapreduce.common.settings import CONFIG
+
+VOCABULARY = 10000  # number of distinct words of `wordcount`
+WORDS_PER_LINE = 10
+
+
+def make_lines(size, rng):
+    """`size` words in lines, drawn from a Zipf-like distribution"""
+    words = ["w%d" % i for i in range(VOCABULARY)]
+    weights = [1 / (i + 1) for i in range(VOCABULARY)]
+    drawn = rng.choices(words, weights, k=size)
+    return [" ".join(drawn[i:i+WORDS_PER_LINE]) for i in range(0, size, WORDS_PER_LINE)]
+
+
+def make_pairs(size, rng, skew=0.0):
+    """(key, value) pairs of uniform keys, `skew` of them have the key 0"""
+    return [(0 if rng.random() < skew else rng.randrange(size), i) for i in range(size)]
+
+
+def to_pair(word):
+    return word, 1
+
+
+def bench_distribute(client, size, rng):
+    data = list(range(size))
+    start = time.perf_counter()
+    client.distribute("distribute", data).wait()
+    return time.perf_counter() - start
+
+
+def bench_collect(client, size, rng):
+    dataset = client.distribute("collect", range(size)).wait()
+    start = time.perf_counter()
+    dataset.collect()
+    return time.perf_counter() - start
+
+
+def bench_wordcount(client, size, rng):
+    lines = client.distribute("lines", make_lines(size, rng)).wait()
+    start = time.perf_counter()
+    lines.flatmap(str.split, inplace=False).map(to_pair).reduce2(add).wait()
+    return time.perf_counter() - start
+
+
+def bench_reduce_high_cardinality(client, size, rng):
+    pairs = client.distribute("pairs", make_pairs(size, rng)).wait()
+    start = time.perf_counter()
+    pairs.reduce2(add, inplace=False).wait()
+    return time.perf_counter() - start
+
+
+def bench_partition_uniform(client, size, rng):
+    pairs = client.distribute("pairs", make_pairs(size, rng)).wait()
+    start = time.perf_counter()
+    pairs.partition().wait()
+    return time.perf_counter() - start
+
+
+def bench_partition_skewed(client, size, rng):
+    pairs = client.distribute("pairs", make_pairs(size, rng, skew=0.5)).wait()
+    start = time.perf_counter()
+    pairs.partition().wait()
+    return time.perf_counter() - start
+
+
+def bench_join_skewed(client, size, rng, skew=False):
+    pairs = client.distribute("pairs", make_pairs(size, rng, skew=0.5)).wait()
+    other = client.distribute("other", make_pairs(size // 10, rng)).wait()
+    start = time.perf_counter()
+    pairs.join(other, skew=skew).wait()
+    return time.perf_counter() - start
+
+
+def bench_join_skewed_salted(client, size, rng):
+    return bench_join_skewed(client, size, rng, skew=True)
+
+
+def uneven_cost(pair):
+    """The items of the key 0 cost much more than the others"""
+    if pair[0] == 0:
+        sum(range(1000))
+    return pair
+
+
+def bench_map_uneven(client, size, rng, balance=False):
+    pairs = client.distribute("pairs", make_pairs(size, rng, skew=0.25)).partition().wait()
+    start = time.perf_counter()
+    pairs.map(uneven_cost, inplace=False).persist(balance=balance).wait()
+    return time.perf_counter() - start
+
+
+def bench_map_uneven_balanced(client, size, rng):
+    return bench_map_uneven(client, size, rng, balance=True)
+
+
+def key_pair(pair):
+    return pair[0], 1
+
+
+def bench_distinct_exact(client, size, rng):
+    pairs = client.distribute("pairs", make_pairs(size, rng)).wait()
+    start = time.perf_counter()
+    pairs.map(key_pair, inplace=False).reduce2(add).count()
+    return time.perf_counter() - start
+
+
+def bench_distinct_approx(client, size, rng):
+    pairs = client.distribute("pairs", make_pairs(size, rng)).wait()
+    start = time.perf_counter()
+    pairs.map(itemgetter(0), inplace=False).count_approx_distinct()
+    return time.perf_counter() - start
+
+
+BENCHMARKS = {
+    'distribute': bench_distribute,
+    'collect': bench_collect,
+    'wordcount': bench_wordcount,
+    'reduce_high_cardinality': bench_reduce_high_cardinality,
+    'partition_uniform': bench_partition_uniform,
+    'partition_skewed': bench_partition_skewed,
+    'join_skewed': bench_join_skewed,
+    'join_skewed_salted': bench_join_skewed_salted,
+    'map_uneven': bench_map_uneven,
+    'map_uneven_balanced': bench_map_uneven_balanced,
+    'distinct_exact': bench_distinct_exact,
+    'distinct_approx': bench_distinct_approx,
+}
+
+
+def run(names, sizes, cores, repeat):
+    """
+    Returns
+    -------
+    List[dict]
+        the seconds of every run of every benchmark, size and number of cores
+    """
+    results = []
+    for num_cores in cores:
+        client = MRClient(num_cores)
+        try:
+            for name in names:
+                for size in sizes:
+                    seconds = []
+                    for i in range(repeat):
+                        rng = random.Random(i)
+                        seconds.append(BENCHMARKS[name](client, size, rng))
+                        client.reset()
+                        gc.collect()
+                    result = {'name': name, 'cores': num_cores, 'size': size,
+                              'seconds': seconds, 'best': min(seconds),
+                              'median': median(seconds),
+                              'records_per_second': size / median(seconds)}
+                    results.append(result)
+                    print("%-24s cores=%-3d size=%-9d median %8.3fs  %12.0f records/s"
+                          % (name, num_cores, size, result['median'],
+                             result['records_per_second']))
+                    sys.stdout.flush()
+        finally:
+            client.terminate()
+    return results
+
+
+def metadata():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': platform.os.cpu_count(),
+        'config': {'batch_bytes': CONFIG.BATCH_BYTES, 'buffer_size': CONFIG.BUFFER_SIZE,
+                   'memory_limit': CONFIG.MEMORY_LIMIT, 'shm_threshold': CONFIG.SHM_THRESHOLD},
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the ratio of the median time of every benchmark to the one
+    of the baseline.
+
+    Returns
+    -------
+    List[dict]
+        the results slower than the baseline by more than `threshold`
+    """
+    before = {(r['name'], r['cores'], r['size']): r for r in baseline['results']}
+    regressions = []
+    print("\n%-24s %5s %9s %10s %10s %7s" % ("benchmark", "cores", "size",
+                                             "baseline", "current", "ratio"))
+    for result in results:
+        old = before.get((result['name'], result['cores'], result['size']))
+        if old is None:
+            continue
+        ratio = result['median'] / old['median']
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(result)
+        print("%-24s %5d %9d %9.3fs %9.3fs %7.2f%s"
+              % (result['name'], result['cores'], result['size'],
+                 old['median'], result['median'], ratio, flag))
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="100000,1000000",
+                        help="comma separated numbers of records")
+    parser.add_argument("--processes", default="1,%d" % max(platform.os.cpu_count() or 1, 2),
+                        help="comma separated numbers of processes")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", default=",".join(BENCHMARKS),
+                        help="comma separated benchmarks to run, of: %s" % ", ".join(BENCHMARKS))
+    parser.add_argument("--output", help="save the results into this JSON file")
+    parser.add_argument("--compare", help="the JSON results of a baseline run")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="flag the benchmarks slower than the baseline by this ratio")
+    args, _ = parser.parse_known_args()
+    names = args.only.split(",")
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error("Unknown benchmark `%s`" % name)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    cores = sorted(set(int(n) for n in args.processes.split(",")))
+    results = run(names, sizes, cores, args.repeat)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({'meta': metadata(), 'results': results}, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
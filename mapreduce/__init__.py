@@ -1,7 +1,16 @@
 from .client import MRClient
+from .pool import WorkerPool
 from .common.settings import CONFIG
 
-__all__ = ['MRClient', 'CONFIG', 'get_service']
+__all__ = ['MRClient', 'AsyncMRClient', 'WorkerPool', 'CONFIG', 'get_service']
+
+
+def __getattr__(name):
+    # asyncio is only imported by the programs using it
+    if name == 'AsyncMRClient':
+        from .async_client import AsyncMRClient
+        return AsyncMRClient
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 
 __master = None
@@ -10,4 +19,4 @@ def get_service():
     global __master
     if __master is None:
         __master = MRClient(CONFIG.CORES)
-    return __master
\ No newline at end of file
+    return __master
@@ -0,0 +1,158 @@
+"""
+An asyncio interface of `MRClient`.
+
+The operations that talk to the processes run on the thread of the
+client, see `MRClient.submit`, so they run one by one in the order they
+are awaited, and the event loop is not blocked while they wait for
+the processes.
+"""
+import asyncio
+from .client import MRClient, Distributed
+from .common.settings import CONFIG
+
+
+class AsyncMRClient:
+    """
+    Parameters
+    ----------
+    client: Optional[MRClient]
+        the client to use, a new one with `num_cores` processes by default
+    """
+    def __init__(self, num_cores=None, client=None):
+        self.client = client or MRClient(num_cores or CONFIG.CORES)
+
+    async def run(self, func, *args, **kwargs):
+        """Run a blocking function of the client, see `MRClient.submit`"""
+        result = await asyncio.wrap_future(self.client.submit(func, *args, **kwargs))
+        return self._wrap(result)
+
+    def _wrap(self, result):
+        if isinstance(result, Distributed):
+            return AsyncDistributed(self, result)
+        return result
+
+    async def distribute(self, name, data):
+        return await self.run(self.client.distribute, name, data)
+
+    async def read_text(self, path, name=None, encoding="utf-8"):
+        return await self.run(self.client.read_text, path, name=name, encoding=encoding)
+
+    async def read_jsonl(self, path, name=None, encoding="utf-8"):
+        return await self.run(self.client.read_jsonl, path, name=name, encoding=encoding)
+
+    async def read_csv(self, path, name=None, encoding="utf-8", header=False, **fmtparams):
+        return await self.run(self.client.read_csv, path, name=name, encoding=encoding,
+                              header=header, **fmtparams)
+
+    async def merge(self, data):
+        return await self.run(self.client.merge, [d.dataset for d in data])
+
+    async def broadcast(self, value):
+        return await self.run(self.client.broadcast, value)
+
+    async def wait(self):
+        """Wait until the processes have answered all the commands sent"""
+        await self.run(self.client.wait)
+
+    async def reset(self):
+        """Remove all the datasets, see `MRClient.reset`"""
+        await self.run(self.client.reset)
+
+    async def terminate(self):
+        # not on the thread of the client, which is shut down by `terminate`
+        await asyncio.get_running_loop().run_in_executor(None, self.client.terminate)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.terminate()
+
+
+def _narrow(name):
+    def method(self, func, **kwargs):
+        return AsyncDistributed(self.client, getattr(self.dataset, name)(func, **kwargs))
+    method.__name__ = name
+    return method
+
+
+def _remote(name):
+    async def method(self, *args, **kwargs):
+        args = [arg.dataset if isinstance(arg, AsyncDistributed) else arg for arg in args]
+        return await self.client.run(getattr(self.dataset, name), *args, **kwargs)
+    method.__name__ = name
+    return method
+
+
+class AsyncDistributed:
+    """
+    A `Distributed` whose operations are coroutines.
+
+    The narrow operations (map, filter, flatmap, map_partitions, sample) only record themselves
+    and are not awaited. The others return as soon as they are sent,
+    like those of `Distributed`, and the actions (collect, count, ...)
+    return when their result is there.
+    """
+    map = _narrow('map')
+    filter = _narrow('filter')
+    flatmap = _narrow('flatmap')
+    map_partitions = _narrow('map_partitions')
+    sample = _narrow('sample')
+
+    reduce = _remote('reduce')
+    reduce2 = _remote('reduce2')
+    combine_by_key = _remote('combine_by_key')
+    aggregate_by_key = _remote('aggregate_by_key')
+    partition = _remote('partition')
+    sort_by_key = _remote('sort_by_key')
+    join = _remote('join')
+    left_join = _remote('left_join')
+    cogroup = _remote('cogroup')
+    key_skew = _remote('key_skew')
+    foreach_partition = _remote('foreach_partition')
+    save_as_text = _remote('save_as_text')
+    save_as_jsonl = _remote('save_as_jsonl')
+    save_as_pickle = _remote('save_as_pickle')
+    count = _remote('count')
+    count_approx_distinct = _remote('count_approx_distinct')
+    approx_quantiles = _remote('approx_quantiles')
+    top_k = _remote('top_k')
+    collect = _remote('collect')
+    take = _remote('take')
+    first = _remote('first')
+    remove = _remote('remove')
+    copy = _remote('copy')
+    persist = _remote('persist')
+    unpersist = _remote('unpersist')
+    wait = _remote('wait')
+
+    def __init__(self, client, dataset):
+        self.client = client
+        self.dataset = dataset
+
+    @property
+    def name(self):
+        return self.dataset.name
+
+    def exists(self):
+        return self.dataset.exists()
+
+    def done(self):
+        return self.dataset.done()
+
+    async def iter_collect(self, limit=None, ordered=False):
+        """
+        Yields
+        ------
+        list
+            the batches, see `MRClient.iter_collect`
+        """
+        stream = await self.client.run(self.dataset.iter_collect, limit=limit, ordered=ordered)
+        try:
+            while 1:
+                batch = await self.client.run(next, stream, None)
+                if batch is None:
+                    break
+                yield batch
+        finally:
+            await self.client.run(stream.close)
@@ -0,0 +1,44 @@
+"""
+Read-only objects sent once to every process.
+"""
+from uuid import uuid4
+
+# the values of the broadcasts received by this process
+BROADCASTS = {}
+_missing = object()
+
+
+def _load(id):
+    return Broadcast(None, id)
+
+
+class Broadcast:
+    """
+    A handle of an object that has been sent to every process by
+    `MRClient.broadcast`.
+
+    Functions that use the object should refer to the handle and
+    read `value` when they run. Only the id of the handle is pickled
+    with the functions, and `value` is the copy kept by the process.
+    """
+    def __init__(self, client, id=None, value=_missing):
+        self.client = client
+        self.id = id or uuid4().hex
+        self._value = value
+
+    @property
+    def value(self):
+        if self._value is not _missing:
+            return self._value
+        try:
+            return BROADCASTS[self.id]
+        except KeyError:
+            raise KeyError("Broadcast `%s` is not available, "
+                           "it may have been unpersisted" % self.id)
+
+    def unpersist(self):
+        """Remove the object from the processes"""
+        self.client.unpersist(self)
+
+    def __reduce__(self):
+        return _load, (self.id,)
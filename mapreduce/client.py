@@ -1,71 +1,143 @@
+import os
+import json
+import math
+import time
+import random
 import atexit
-from time import sleep
-from collections import namedtuple
+import weakref
+import threading
+from copy import deepcopy
 from contextlib import contextmanager
-from queue import Empty
-from multiprocess import Queue, Process, Pipe, Value
-from .server import MRServer
+from itertools import islice
+from functools import partial
+from operator import itemgetter
+from time import perf_counter
+from collections import deque, Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from .server import RemoteError, identity
+from .pool import WorkerPool
 from .common.settings import CONFIG
-from .common.itertools import bufferize
-from .common.io import robust_recv
+from .common.itertools import make_batcher
+from .common.hashing import partition_keys
+from .common.io import CLIENT, COUNTERS, StreamWriter, StreamReader
+from .common.transport import encode, release
+from .common.serialization import dumps_command
+from .common.arrays import np, as_array, merge_aggregates
+from .common.files import list_files, split_ranges, remove_parts
+from .common.stats import summarize, chrome_trace, merge_profiles
+from .common.lineage import Lineage, reads, writes
+from .common.sketches import HyperLogLog, KLL, SpaceSaving, sample_items
+from .broadcast import Broadcast
 
 
-Channel = namedtuple('Channel', ['queue', 'pipe', 'state'])
+SAMPLES_PER_PROCESS = 1000  # number of keys sampled by every process in `sort_by_key`
+MAX_PENDING = 64            # number of commands sent ahead of their answers
+MAX_EVENTS = 100000         # number of answered commands whose events are kept
+HOT_KEY_LOAD = 0.5          # a key is hot if it alone makes this share of the load of a process
+TOP_K_COUNTERS = 10         # counters per item asked for by `top_k`
+# the narrow operations that `persist` can split into tasks
+BALANCED_OPERATIONS = {'map', 'filter', 'flatmap'}
 
 
 class StandardOperation:
+    """
+    A narrow operation. It is only recorded in the lineage of the
+    returned dataset and is executed, fused with the neighbouring
+    narrow operations, when an action needs the data.
+    """
     def __init__(self, action):
         self.action = action
-        self.funcs = {}
 
     def __get__(self, obj, type=None):
-        if id(obj) not in self.funcs:
-            def function(func, dataset, inplace=True):
-                if inplace:
-                    name = dataset.name
-                else:
-                    postfix = hex(abs(id(func)))
-                    name = "/".join([dataset.name, self.action, postfix])
-                    name = obj._register_name(name)
-                with obj.acquire():
-                    obj._send({'action': self.action, 'src': dataset.name, 'dest': name, 'func': func})
-                return Distributed(obj, name)
-            function.__name__ = self.action
-            self.funcs[id(obj)] = function
-        return self.funcs[id(obj)]
+        if obj is None:
+            return self
+        # made on every access, keeping nothing that would keep the client alive
+        def function(func, dataset, inplace=True):
+            if inplace:
+                return dataset._append((self.action, func))
+            name = obj._derive_name(dataset, self.action, func, inplace)
+            return Distributed(obj, name, parent=dataset, stage=(self.action, func))
+        function.__name__ = self.action
+        return function
 
 
 class MRClient:
     map = StandardOperation("map")
     filter = StandardOperation("filter")
-    reduce = StandardOperation("reduce")
     flatmap = StandardOperation("flatmap")
-    def __init__(self, num_cores):
-        self.num_cores = num_cores
+    map_partitions = StandardOperation("map_partitions")
+    map_partitions_with_index = StandardOperation("map_partitions_with_index")
+    def __init__(self, num_cores=None, pool=None):
+        """
+        Parameters
+        ----------
+        num_cores: int
+            number of processes, `CONFIG.CORES` by default
+        pool: Optional[WorkerPool]
+            the processes to use, kept when the client terminates.
+            New processes are started by default.
+        """
+        self.__terminated = True    # until the processes are acquired
+        self.own_pool = pool is None
+        self.pool = WorkerPool(num_cores) if pool is None else pool
+        self.pool.acquire(self)
+        self.num_cores = self.pool.num_cores
         self.names = set()
-        self.global_queue = Queue()
-        self.pool = []
-        self.channels = []
+        self.global_queue = self.pool.global_queue
+        self.stop = self.pool.stop
+        self.channels = self.pool.channels
+        self.stream = None
+        self.broadcasts = set()
+        self.dispatch_times = {}
+        self.wait_times = {}
+        self.commands = deque(maxlen=MAX_EVENTS)
+        self.profiled = set()
+        self.profiles = {}
+        self.lineage = Lineage()
+        self.refs = {}              # number of handles of every dataset name
+        self.released = deque()     # the names whose handles were all collected
+        self.cache_counters = {'evicted': 0, 'recomputed': 0, 'freed': 0}
+        self.lock = threading.RLock()
+        # its thread is only started by the first `submit`
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mapreduce")
+        self.__pending = deque()
         self.__terminated = False
         atexit.register(self.__del__)
-        queues = [Queue() for _ in range(num_cores)]
-        for i in range(num_cores):
-            pipe_master, pipe_slave = Pipe()
-            state = Value('i', 0)
-            process = MRServer(i, queues, pipe_slave, state, self.global_queue)
-            self.channels.append(Channel(queues[i], pipe_master, state))
-            self.pool.append(process)
-            process.start()
 
     def wait(self, queue=True):
-        while not self.idle(queue):
-            sleep(0.01)
+        """
+        Wait until the processes have answered all the commands sent
+
+        Parameters
+        ----------
+        queue: bool
+            not used, kept for compatibility. The streams between the
+            processes are done with once their commands are answered.
+        """
+        with self.lock:
+            if self.stream is not None:
+                self.stream.close()
+            start = perf_counter()
+            while self.__pending:
+                self._recv()
+            self._add_wait('wait', perf_counter() - start)
+
+    def _add_wait(self, action, seconds):
+        times = self.wait_times.setdefault(action, [0, 0.0])
+        times[0] += 1
+        times[1] += seconds
 
     def idle(self, queue=True):
-        if queue:
-            return self.global_queue.empty() and all(map(lambda x: x.state.value==0 and x.queue.empty(), self.channels))
-        else:
-            return all(map(lambda x: x.state.value==0, self.channels))
+        """Whether the processes have answered all the commands sent, see `wait`"""
+        return not self.__pending
+
+    @contextmanager
+    def acquire(self, queue=True):
+        """
+        Wait until the processes are idle, see `wait`
+        """
+        self.wait(queue)
+        yield
 
     def _register_name(self, name):
         i = 0
@@ -76,26 +148,259 @@ class MRClient:
             else:
                 self.names.add(name)
                 return name
+
+    def _derive_name(self, dataset, action, func, inplace):
+        """The name under which the result of an operation is stored"""
+        if inplace:
+            return dataset.name
+        postfix = hex(abs(id(func)))
+        name = "/".join([dataset.name, action, postfix])
+        return self._register_name(name)
     
-    @contextmanager
-    def acquire(self, queue=True):
+    def submit(self, func, *args, **kwargs):
         """
-        Wait until the processes are idle
+        Run `func(*args, **kwargs)`, e.g. `dataset.count`, in the
+        background. The functions submitted run one by one, in the
+        order they are submitted, on a thread of the client.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            the result of the function
         """
-        self.wait(queue)
-        yield
-    
+        return self.executor.submit(func, *args, **kwargs)
+
     def _send(self, item):
-        """Send commands to processes"""
-        for channel in self.channels:
-            channel.pipe.send(item)
+        """
+        Send commands to processes without waiting for the answer.
+        The processes run the commands in the order they are sent.
+
+        The command is recorded in the lineage of the datasets, see
+        `common.lineage`. The datasets it reads are recomputed first if
+        they have been evicted, and so are the evicted datasets that
+        need the data it replaces. The datasets whose handles have all
+        been collected are removed, and the least recently used ones
+        are evicted if the processes hold more than `CONFIG.CACHE_LIMIT`.
+
+        Returns
+        -------
+        Future
+            the answers of the processes to the command, see `_result`
+        """
+        with self.lock:
+            if self.stream is not None:
+                self.stream.close()
+            replays = self._remove_released()
+            for name in reads(item):
+                if name in self.lineage.evicted:
+                    replays += self._recompute(name)
+            dest = writes(item)
+            if dest is not None:
+                for name in self.lineage.dependents(dest):
+                    replays += self._recompute(name)
+            self.lineage.record(item)
+            future = self._dispatch(item)
+            future.replays = replays
+            if CONFIG.CACHE_LIMIT:
+                for name in self.lineage.victims(CONFIG.CACHE_LIMIT * 2 ** 20):
+                    self._evict(name)
+            return future
+
+    def _dispatch(self, item):
+        """
+        Send a command as it is.
+
+        The command is pickled only once, the time it takes is added
+        up in `dispatch_times` by action. The actions in `profiled` are
+        run under cProfile, see `profile`.
+        """
+        with self.lock:
+            if len(self.__pending) >= MAX_PENDING:
+                self._recv()
+            start = perf_counter()
+            if item['action'] in self.profiled:
+                item = dict(item, profile=True)
+            data = dumps_command(item)
+            for channel in self.channels:
+                channel.pipe.send_bytes(data)
+            future = Future()
+            future.set_running_or_notify_cancel()
+            future.action = item['action']
+            future.replays = []     # the commands replayed for it, see `_recompute`
+            self.__pending.append((future, time.time()))
+            times = self.dispatch_times.setdefault(item['action'], [0, 0.0])
+            times[0] += 1
+            times[1] += perf_counter() - start
+            return future
 
     def _recv(self):
         """
-        Receive info from processes.
+        Receive the answers of the processes to the earliest
+        unanswered command, and resolve its future with them,
+        or with the `RemoteError` of the first process that failed,
+        or of the first command replayed for it that failed.
+        The events of the processes are kept in `commands`.
+        """
+        with self.lock:
+            answers = [channel.answers.get() for channel in self.channels]
+            future, sent = self.__pending.popleft()
+        replies = [reply for reply, _ in answers]
+        events = [event for _, event in answers]
+        for event in events:
+            if 'datasets' in event:
+                self.lineage.report(event['ith'], event.pop('datasets'))
+            if 'profile' in event:
+                self.profiles.setdefault(future.action, []).append(event.pop('profile'))
+        self.commands.append({'action': future.action, 'sent': sent,
+                              'answered': time.time(), 'workers': events})
+        # the replayed commands were sent, and so answered, before it
+        errors = [replay.exception() for replay in future.replays] + replies
+        for error in errors:
+            if isinstance(error, RemoteError):
+                future.set_exception(error)
+                return
+        future.set_result(replies)
+
+    def _evict(self, name):
+        """Remove a dataset from the processes, keeping its lineage"""
+        self._dispatch({'action': 'remove_dataset', 'name': name})
+        self.lineage.evicted.add(name)
+        self.cache_counters['evicted'] += 1
+
+    def _recompute(self, name):
+        """
+        Recompute an evicted dataset from its lineage
+
+        Returns
+        -------
+        List[Future]
+            the answers to the commands replayed
+        """
+        plan = self.lineage.plan(name)
+        futures = [self._dispatch(command) for command in plan['commands']]
+        for temp in plan['temps']:
+            self._dispatch({'action': 'remove_dataset', 'name': temp})
+        for restored in plan['restore'] + [name]:
+            self.lineage.evicted.discard(restored)
+        self.cache_counters['recomputed'] += 1
+        return futures
+
+    def _acquire(self, name):
+        self.refs[name] = self.refs.get(name, 0) + 1
+
+    def _release(self, name):
+        # called by the garbage collector, the dataset is removed by the next `_send`
+        self.refs[name] -= 1
+        if not self.refs[name]:
+            self.released.append(name)
+
+    def _remove_released(self):
+        """
+        Remove the datasets whose handles have all been collected
+
+        Returns
+        -------
+        List[Future]
+            the answers to the commands replayed to recompute the
+            datasets that need them, see `_recompute`
+        """
+        replays = []
+        while self.released:
+            name = self.released.popleft()
+            if self.refs.get(name, 1):
+                continue
+            del self.refs[name]
+            if name in self.lineage.current:
+                for other in self.lineage.dependents(name):
+                    replays += self._recompute(other)
+                self._dispatch({'action': 'remove_dataset', 'name': name})
+                self.lineage.forget(name)
+                self.names.discard(name)
+                self.cache_counters['freed'] += 1
+        return replays
+
+    def _result(self, future):
+        """
+        Wait for the answers to a command sent by `_send`
+
+        Returns
+        -------
+        list
+            the answer of every process
+        """
+        with self.lock:
+            start = perf_counter()
+            while not future.done():
+                self._recv()
+            self._add_wait(future.action, perf_counter() - start)
+        return future.result()
+
+    def stats(self):
+        """
+        Returns
+        -------
+        dict
+            `actions`: what the processes did for every action, see
+            `common.stats.summarize`, along with the `dispatch` time
+            spent pickling and sending the commands and the `client_wait`
+            time spent waiting for their answers;
+            `client`: what the streams of the client moved, the time
+            it spent in `wait`, and the number of datasets `evicted`,
+            `recomputed` and `freed` as their handles were collected
+        """
+        with self.lock:
+            summary = summarize(self.commands)
+            for action, stats in summary.items():
+                stats['dispatch'] = self.dispatch_times.get(action, [0, 0.0])[1]
+                stats['client_wait'] = self.wait_times.get(action, [0, 0.0])[1]
+            client = dict(COUNTERS, wait=self.wait_times.get('wait', [0, 0.0])[1],
+                          **self.cache_counters)
+        return {'actions': summary, 'client': client}
+
+    def export_trace(self, path):
+        """
+        Write the events of the commands into a Chrome trace JSON file,
+        which can be opened in chrome://tracing or Perfetto.
+        """
+        with self.lock:
+            trace = chrome_trace(self.commands)
+        with open(path, "w") as file:
+            json.dump(trace, file)
+
+    def reset_stats(self):
+        """Forget the events and profiles recorded so far"""
+        with self.lock:
+            self.commands.clear()
+            self.profiles.clear()
+            self.dispatch_times.clear()
+            self.wait_times.clear()
+
+    def profile(self, *actions):
+        """
+        Run the commands of the actions, e.g. 'reduce' or 'count', under
+        cProfile in the processes from now on, or stop profiling if no
+        action is given. See `profile_stats`.
+        """
+        with self.lock:
+            self.profiled = set(actions)
+
+    def profile_stats(self, action):
+        """
+        Returns
+        -------
+        pstats.Stats
+            the profiles of the commands of an action in all the
+            processes, added up
+        """
+        return merge_profiles(self.profiles.get(action, ()))
+
+    def _derived(self, name, futures, *sources):
         """
-        for channel in self.channels:
-            yield channel.pipe.recv()
+        The dataset made by the commands of the `futures` from the
+        `sources`, it depends on the commands that made them too.
+        """
+        dependencies = [f for source in sources for f in source.dependencies()]
+        return Distributed(self, name, futures=dependencies + list(futures))
 
     def distribute(self, name, data):
         """
@@ -106,26 +411,296 @@ class MRClient:
         name: str
             Store the data by a key `name`.
         data: Iterable
-            the data to be distributed.
+            the data to be distributed. It is read a batch per process
+            at a time, which is split evenly between the processes, so
+            that they get the same number of items give or take one.
         """
         name = self._register_name(name)
         if isinstance(data, dict):
             data = data.items()
-        i = 0
         n = self.num_cores
-        with self.acquire():
-            for batch in bufferize(data, CONFIG.BUFFER_SIZE):
-                self.channels[i % n].queue.put(batch)
-                i += 1
-            self._send({'action': "add_dataset", 'name': name})
-        return Distributed(self, name)
+        counts = [0] * n
+        with self.lock:
+            future = self._send({'action': "add_dataset", 'name': name})
+            batcher = make_batcher(spread=n)
+            writers = [StreamWriter(channel.queue, CLIENT, batcher) for channel in self.channels]
+            iterator = iter(data)
+            try:
+                while 1:
+                    items = list(islice(iterator, batcher.size * n))
+                    if not items:
+                        break
+                    # the larger parts go to the processes with the fewest items
+                    order = sorted(range(n), key=counts.__getitem__)
+                    size, larger = divmod(len(items), n)
+                    start = 0
+                    for j, i in enumerate(order):
+                        end = start + size + (j < larger)
+                        if end > start:
+                            writers[i].put(items[start:end])
+                            counts[i] += end - start
+                        start = end
+            finally:
+                for writer in writers:
+                    writer.close()
+        return Distributed(self, name, futures=[future])
+
+    def read_text(self, path, name=None, encoding="utf-8"):
+        """
+        Read the lines of text files in parallel. The files are split
+        into a byte range per process, and every process reads its own
+        range, nothing goes through the client. The files compressed
+        with gzip, bz2 or xz, e.g. by `save_as_text`, are read whole by
+        a single process each.
+
+        Parameters
+        ----------
+        path: str
+            a file, a directory, or a glob pattern
+        name: Optional[str]
+            Store the data by a key `name`, the base name of `path` by default.
+
+        Returns
+        -------
+        Distributed
+            the lines, without the line breaks
+        """
+        return self._read_files(path, name, 'text', {'encoding': encoding})
+
+    def read_jsonl(self, path, name=None, encoding="utf-8"):
+        """Read files of a JSON object per line, see `read_text`"""
+        return self._read_files(path, name, 'jsonl', {'encoding': encoding})
+
+    def read_csv(self, path, name=None, encoding="utf-8", header=False, **fmtparams):
+        """
+        Read CSV files, see `read_text`.
+
+        Parameters
+        ----------
+        header: bool
+            whether the first line of every file holds the names of the
+            columns, the rows are dicts keyed by them then
+        fmtparams:
+            passed to `csv.reader`. Note that a quoted field must
+            not hold a line break.
+        """
+        options = dict(fmtparams, encoding=encoding, header=header)
+        return self._read_files(path, name, 'csv', options)
+
+    def _read_files(self, path, name, format, options):
+        paths = list_files(path)
+        name = self._register_name(name or os.path.basename(path.rstrip(os.sep)))
+        future = self._send({'action': 'read_files', 'name': name, 'format': format,
+                             'ranges': split_ranges(paths, self.num_cores),
+                             'options': options})
+        return Distributed(self, name, futures=[future])
+
+    def save_as_text(self, dataset, directory, compression=None, encoding="utf-8",
+                     overwrite=False):
+        """
+        Write the dataset into a directory, a line per item. Every process
+        writes its own `part-XXXXX` file at the same time, nothing but the
+        paths goes through the client.
+
+        Parameters
+        ----------
+        directory: str
+            the directory to write into, it is created if missing
+        compression: Optional[str]
+            None, 'gzip', 'bz2' or 'xz'
+        overwrite: bool
+            whether to replace the part files already in the directory,
+            otherwise they raise FileExistsError
+
+        Returns
+        -------
+        List[Tuple[str, int]]
+            the path of every file and the number of items in it
+        """
+        return self._save(dataset, directory, 'text', compression, overwrite,
+                          {'encoding': encoding})
+
+    def save_as_jsonl(self, dataset, directory, compression=None, overwrite=False):
+        """Write the dataset as a JSON object per line, see `save_as_text`"""
+        return self._save(dataset, directory, 'jsonl', compression, overwrite)
+
+    def save_as_pickle(self, dataset, directory, compression=None, overwrite=False):
+        """Write the dataset as pickled batches of items, see `save_as_text`"""
+        return self._save(dataset, directory, 'pickle', compression, overwrite)
+
+    def save_as_npy(self, dataset, directory, compression=None, overwrite=False):
+        """Write the chunk of every process as a .npy file, see `save_as_text`"""
+        return self._save(dataset, directory, 'npy', compression, overwrite)
+
+    def _save(self, dataset, directory, format, compression, overwrite, options=None):
+        os.makedirs(directory, exist_ok=True)
+        if overwrite:
+            remove_parts(directory)
+        elif any(name.startswith("part-") for name in os.listdir(directory)):
+            raise FileExistsError("`%s` holds part files already" % directory)
+        src, stages = dataset.plan()
+        dataset.wait()
+        return self._result(self._send({'action': 'save', 'name': src, 'stages': stages,
+                                        'directory': os.path.abspath(directory),
+                                        'format': format, 'compression': compression,
+                                        'options': options}))
+
+    def distribute_array(self, name, data):
+        """
+        Distribute a numpy array to processes, every process gets
+        a contiguous chunk of the rows. The chunks are not pickled item
+        by item, large ones are passed through shared memory.
+
+        Parameters
+        ----------
+        name: str
+            Store the data by a key `name`.
+        data: Union[numpy.ndarray, Dict[str, array_like]]
+            an array, or a table given as a dict of columns,
+            which is stored as a structured array
+
+        Returns
+        -------
+        ArrayDistributed
+        """
+        array = as_array(data)
+        name = self._register_name(name)
+        with self.lock:
+            future = self._send({'action': 'add_array', 'name': name})
+            for channel, chunk in zip(self.channels, np.array_split(array, self.num_cores)):
+                writer = StreamWriter(channel.queue, CLIENT)
+                writer.put(chunk)
+                writer.close()
+        return ArrayDistributed(self, name, futures=[future])
+
+    def map_array(self, func, dataset, with_index=False, inplace=True):
+        """
+        Parameters
+        ----------
+        func: numpy.ndarray -> numpy.ndarray
+            maps the whole chunk of every process to a new array
+        with_index: bool
+            call `func(index, chunk)` with the index of the process instead
+        """
+        name = self._derive_name(dataset, 'map_array', func, inplace)
+        future = self._send({'action': 'map_array', 'src': dataset.name, 'dest': name,
+                             'func': func, 'with_index': with_index})
+        return ArrayDistributed(self, name, futures=dataset.dependencies() + [future])
+
+    def filter_mask(self, func, dataset, inplace=True):
+        """
+        Parameters
+        ----------
+        func: numpy.ndarray -> numpy.ndarray
+            maps the whole chunk of every process to a boolean mask
+            of the rows to keep
+        """
+        name = self._derive_name(dataset, 'filter_mask', func, inplace)
+        future = self._send({'action': 'filter_mask', 'src': dataset.name, 'dest': name,
+                             'func': func})
+        return ArrayDistributed(self, name, futures=dataset.dependencies() + [future])
+
+    def sum_array(self, dataset, column=None):
+        """
+        Parameters
+        ----------
+        column: Union[None, str, callable]
+            the field of a table to sum, or a function that maps a chunk
+            to the array to sum
+
+        Returns
+        -------
+        The sum of the rows
+        """
+        dataset.wait()
+        return sum(self._result(self._send({'action': 'sum_array', 'name': dataset.name,
+                                            'column': column})))
+
+    def group_aggregate(self, dataset, key, value=None, how='sum'):
+        """
+        Aggregate the values of every key, every process aggregates
+        its own chunk and the client merges the results.
+
+        Parameters
+        ----------
+        key, value: Union[str, callable]
+            the field of a table, or a function that maps a chunk to
+            the array of keys or values
+        how: str
+            'sum', 'count', 'min', 'max' or 'mean'
+
+        Returns
+        -------
+        Tuple[numpy.ndarray, numpy.ndarray]
+            the sorted unique keys, and the aggregated value of every key
+        """
+        dataset.wait()
+        partials = self._result(self._send({'action': 'group_aggregate', 'name': dataset.name,
+                                            'key': key, 'value': value, 'how': how}))
+        return merge_aggregates(partials, how)
+
+    def collect_array(self, dataset):
+        """
+        Returns
+        -------
+        numpy.ndarray
+            the chunks of the processes joined in order
+        """
+        dataset.wait()
+        stream = self._open_stream({'action': 'collect_array', 'name': dataset.name}, True)
+        return np.concatenate(list(stream))
 
     def copy(self, dataset):
         """A shallow copy of the current dataset"""
         name = self._register_name(dataset.name)
-        with self.acquire():
-            self._send({'action': 'copy', 'src': dataset.name, 'dest': name})
-        return Distributed(self, name)
+        src, stages = dataset.plan()
+        future = self._send({'action': 'persist', 'src': src, 'dest': name, 'stages': stages})
+        return self._derived(name, [future], dataset)
+
+    def persist(self, dataset, balance=False):
+        """
+        Run the pending operations of the dataset and store the
+        result on the processes, so that later actions start from
+        here instead of recomputing the whole chain. The dataset is
+        only evicted beyond `CONFIG.CACHE_LIMIT` if evicting the ones
+        that are not persisted is not enough, see `unpersist`.
+
+        Parameters
+        ----------
+        balance: bool
+            split the items into small tasks, which the processes that
+            are done early steal from the busy ones, so that uneven
+            partitions or uneven costs of the items do not leave
+            processes idle. The items end up on the process that ran
+            their task. Only `map`, `filter` and `flatmap` can be split.
+        """
+        if balance:
+            src, stages = dataset.plan()
+            for action, _ in stages:
+                if action not in BALANCED_OPERATIONS:
+                    raise ValueError("`%s` can not be split into tasks" % action)
+            future = self._send({'action': 'persist', 'src': src, 'dest': dataset.name,
+                                 'stages': stages, 'balance': True})
+            dataset.futures = dataset.dependencies() + [future]
+            dataset.materialized = True
+        elif not dataset.materialized:
+            src, stages = dataset.plan()
+            future = self._send({'action': 'persist', 'src': src, 'dest': dataset.name,
+                                 'stages': stages})
+            dataset.futures = dataset.dependencies() + [future]
+            dataset.materialized = True
+        self.lineage.persisted.add(dataset.name)
+        return dataset
+
+    def reduce(self, func, dataset, inplace=True):
+        """
+        Reduce the values of the same key in seperate processes.
+        """
+        name = self._derive_name(dataset, 'reduce', func, inplace)
+        src, stages = dataset.plan()
+        future = self._send({'action': 'reduce', 'src': src, 'dest': name,
+                             'func': func, 'stages': stages})
+        return self._derived(name, [future], dataset)
 
     def reduce2(self, func, dataset, inplace=True):
         """
@@ -133,10 +708,50 @@ class MRClient:
         Step 2: Partition;
         Step 3: Reduce in seperate processes again.
         """
-        data = dataset.reduce(func, inplace=inplace) \
-                      .partition() \
-                      .reduce(func,inplace=True)
-        return data
+        return self.combine_by_key(identity, func, func, dataset, inplace=inplace)
+
+    def combine_by_key(self, create_combiner, merge_value, merge_combiners, dataset, inplace=True):
+        """
+        Aggregate the values of each key in one pass over the data.
+
+        Step 1: Combine the values into one combiner per key in seperate processes;
+        Step 2: Partition;
+        Step 3: Merge the combiners of the same key in seperate processes.
+
+        Parameters
+        ----------
+        create_combiner: value -> combiner
+            turns the first value of a key into a combiner
+        merge_value: (combiner, value) -> combiner
+            adds a value into a combiner
+        merge_combiners: (combiner, combiner) -> combiner
+            merges two combiners of the same key
+        """
+        name = self._derive_name(dataset, 'combine_by_key', merge_value, inplace)
+        src, stages = dataset.plan()
+        future = self._send({'action': 'combine_by_key', 'src': src, 'dest': name,
+                             'create_combiner': create_combiner, 'merge_value': merge_value,
+                             'merge_combiners': merge_combiners, 'stages': stages})
+        data = self._derived(name, [future], dataset)
+        return data.partition().reduce(merge_combiners, inplace=True)
+
+    def aggregate_by_key(self, zero, seq_op, comb_op, dataset, inplace=True):
+        """
+        Aggregate the values of each key starting from `zero`.
+
+        Parameters
+        ----------
+        zero: object
+            the initial value of every key, it is copied before use
+            so that mutable values are not shared between keys
+        seq_op: (aggregate, value) -> aggregate
+            adds a value into an aggregate
+        comb_op: (aggregate, aggregate) -> aggregate
+            merges two aggregates of the same key
+        """
+        def create_combiner(value):
+            return seq_op(deepcopy(zero), value)
+        return self.combine_by_key(create_combiner, seq_op, comb_op, dataset, inplace=inplace)
 
     def partition(self, dataset, by=None):
         """
@@ -150,22 +765,192 @@ class MRClient:
             this key decides which process to put
             the data on.
         """
-        with self.acquire():
-            self._send({'action': 'partition', 'name': dataset.name, 'by': by})
-        with self.acquire(queue=False):
-            self._send({'action': "add_dataset", 'name': dataset.name})
+        src, stages = dataset.plan()
+        future = self._send({'action': 'partition', 'src': src, 'dest': dataset.name,
+                             'by': by, 'stages': stages})
+        dataset.futures = dataset.dependencies() + [future]
+        dataset.materialized = True
         return dataset
 
+    def sort_by_key(self, dataset, key=None, ascending=True, inplace=True):
+        """
+        Sort the dataset across the processes.
+
+        Step 1: Sample the keys in seperate processes and choose
+                the boundaries of the key range of every process;
+        Step 2: Partition by the ranges;
+        Step 3: Sort in seperate processes.
+
+        The processes hold consecutive ranges of the keys afterwards,
+        so `collect` returns all the data in order.
+
+        Parameters
+        ----------
+        key: object -> object
+            a function that maps object to the key to sort by,
+            by default the first element of the object
+        ascending: bool
+            sort in ascending order or not
+        """
+        key = key or itemgetter(0)
+        src, stages = dataset.plan()
+        size = SAMPLES_PER_PROCESS
+        dataset.wait()
+        samples = self._result(self._send({'action': 'sample_keys', 'name': src, 'by': key,
+                                           'size': size, 'stages': stages}))
+        boundaries = choose_boundaries(samples, self.num_cores)
+        name = self._derive_name(dataset, 'sort_by_key', key, inplace)
+        with self.lock:
+            partitioned = self._send({'action': 'partition', 'src': src, 'dest': name, 'by': key,
+                                      'stages': stages, 'boundaries': boundaries,
+                                      'ascending': ascending})
+            future = self._send({'action': 'sort', 'src': name, 'dest': name,
+                                 'key': key, 'ascending': ascending})
+        return self._derived(name, [partitioned, future], dataset)
+
+    def _shuffle(self, dataset, hot=None, replicate=False):
+        """
+        Partition the dataset into a new one, leaving it untouched.
+        The items of the `hot` keys are spread over the processes of
+        the key, or sent to all of them if `replicate`.
+        """
+        name = self._register_name("/".join([dataset.name, "partition"]))
+        src, stages = dataset.plan()
+        command = {'action': 'partition', 'src': src, 'dest': name, 'stages': stages}
+        if hot:
+            command.update(hot=hot, replicate=replicate)
+        future = self._send(command)
+        return self._derived(name, [future], dataset)
+
+    def key_skew(self, dataset, by=None):
+        """
+        Estimate how unevenly the keys of a dataset are spread, from
+        a sample of `SAMPLES_PER_PROCESS` keys of every process.
+
+        Parameters
+        ----------
+        by: object -> object
+            a function that maps object to its key, by default the
+            first element of the object
+
+        Returns
+        -------
+        dict
+            see `find_hot_keys`
+        """
+        return self._hot_keys(dataset, by)[1]
+
+    def _hot_keys(self, dataset, by=None):
+        src, stages = dataset.plan()
+        dataset.wait()
+        samples = self._result(self._send({'action': 'sample_keys', 'name': src,
+                                           'by': by or itemgetter(0),
+                                           'size': SAMPLES_PER_PROCESS, 'stages': stages}))
+        return find_hot_keys(samples, self.num_cores)
+
+    def join(self, dataset, other, how='inner', broadcast=False, skew=False):
+        """
+        Join two datasets of (key, value) pairs by their keys.
+
+        Both datasets are partitioned by key, so that the pairs of the
+        same key are on the same process, and then joined by a hash join
+        in seperate processes.
+        If `other` is small, it can be broadcast instead: it is collected
+        and sent once to every process, and `dataset` is not partitioned.
+
+        Parameters
+        ----------
+        other: Distributed
+            the dataset to join with
+        how: str
+            'inner' to keep only the keys in both datasets, or 'left'
+            to keep all the pairs of `dataset`
+        broadcast: bool
+            broadcast `other` instead of partitioning both datasets
+        skew: bool
+            sample the keys of `dataset` first, and spread the pairs of
+            its hot keys over several processes instead of the one of
+            their hash. The pairs of `other` with a hot key are sent to
+            all the processes of the key. See `find_hot_keys`.
+
+        Returns
+        -------
+        Distributed
+            (key, (value, other value)) pairs, the other value is None
+            for the pairs of `dataset` without a match in a left join
+        """
+        if how not in ('inner', 'left'):
+            raise ValueError("Unknown join `%s`" % how)
+        name = self._register_name("/".join([dataset.name, "join", other.name]))
+        if broadcast:
+            table = self.broadcast(other.collect())
+            src, stages = dataset.plan()
+            future = self._send({'action': 'hash_join', 'src': src, 'dest': name, 'how': how,
+                                 'table': table, 'stages': stages})
+            table.unpersist()
+            return self._derived(name, [future], dataset)
+        hot = self._hot_keys(dataset)[0] if skew else None
+        with self.lock:
+            left = self._shuffle(dataset, hot)
+            right = self._shuffle(other, hot, replicate=True)
+            future = self._send({'action': 'hash_join', 'src': left.name, 'dest': name,
+                                 'how': how, 'right': right.name})
+            left.remove()
+            right.remove()
+        return self._derived(name, [future], left, right)
+
+    def left_join(self, dataset, other, broadcast=False, skew=False):
+        """See `join`"""
+        return self.join(dataset, other, how='left', broadcast=broadcast, skew=skew)
+
+    def cogroup(self, dataset, other):
+        """
+        Group two datasets of (key, value) pairs by their keys.
+
+        Returns
+        -------
+        Distributed
+            (key, (values, other values)) pairs for every key in
+            either dataset
+        """
+        name = self._register_name("/".join([dataset.name, "cogroup", other.name]))
+        with self.lock:
+            left = self._shuffle(dataset)
+            right = self._shuffle(other)
+            future = self._send({'action': 'cogroup', 'left': left.name, 'right': right.name,
+                                 'dest': name})
+            left.remove()
+            right.remove()
+        return self._derived(name, [future], left, right)
+
     def merge(self, data):
         """
         Merges multiple datasets to a new one.
         """
         new_name = "/".join(["merge"] + [d.name for d in data])
         name = self._register_name(new_name)
-        self._send({'action': 'merge',
-                    'src': [d.name for d in data],
-                    'dest': name})
-        return Distributed(self, name)
+        future = self._send({'action': 'merge',
+                             'src': [d.plan() for d in data],
+                             'dest': name})
+        return self._derived(name, [future], *data)
+
+    def foreach_partition(self, func, dataset, with_index=False):
+        """
+        Run a function on the whole partition of every process, for
+        its side effects, e.g. writing a file per process.
+
+        Parameters
+        ----------
+        func: Iterator -> None
+            gets an iterator of the items of the process, it may also
+            be a generator, which is run to its end
+        with_index: bool
+            call `func(index, iterator)` with the index of the process instead
+        """
+        src, stages = dataset.plan()
+        dataset.wait()
+        self._result(self._send({'action': 'foreach_partition', 'name': src, 'func': func,
+                                 'stages': stages, 'with_index': with_index}))
 
     def count(self, dataset):
         """
@@ -174,19 +959,111 @@ class MRClient:
         The length of the dataset
         """
         n = 0
-        with self.acquire():
-            self._send({'action': 'count', 'name': dataset.name})
-            for c in self._recv():
-                n += c
+        src, stages = dataset.plan()
+        dataset.wait()
+        for c in self._result(self._send({'action': 'count', 'name': src, 'stages': stages})):
+            n += c
         return n
 
+    def count_approx_distinct(self, dataset, precision=12):
+        """
+        Estimate the number of distinct items by a HyperLogLog sketch,
+        in one pass and without a shuffle.
+
+        Parameters
+        ----------
+        precision: int
+            the sketch has `2 ** precision` registers, the relative
+            error is about `1.04 / sqrt(2 ** precision)`
+
+        Returns
+        -------
+        int
+        """
+        return self._sketch(dataset, HyperLogLog(precision)).count()
+
+    def approx_quantiles(self, dataset, quantiles, k=200):
+        """
+        Estimate quantiles of comparable items by a KLL sketch,
+        in one pass and without a shuffle.
+
+        Parameters
+        ----------
+        quantiles: Iterable[float]
+            the ranks, from 0 to 1, e.g. [0.5, 0.99]
+        k: int
+            the size of the sketch, the rank of an answer is off by
+            about `1.7 / k` of the number of items
+
+        Returns
+        -------
+        list
+            the item at every rank, None if the dataset is empty
+        """
+        return self._sketch(dataset, KLL(k)).quantiles(quantiles)
+
+    def top_k(self, dataset, k, capacity=None):
+        """
+        Estimate the most frequent items by a Space-Saving sketch,
+        in one pass and without a shuffle.
+
+        Parameters
+        ----------
+        capacity: Optional[int]
+            number of items counted by every sketch, `TOP_K_COUNTERS * k`
+            by default. A count is over-estimated by at most the number
+            of items divided by `capacity`.
+
+        Returns
+        -------
+        List[Tuple[object, int]]
+            the `k` most frequent items and their counts, the most frequent first
+        """
+        return self._sketch(dataset, SpaceSaving(capacity or TOP_K_COUNTERS * k)).top(k)
+
+    def _sketch(self, dataset, sketch):
+        """Feed the items of every process into `sketch`, and merge the sketches"""
+        src, stages = dataset.plan()
+        dataset.wait()
+        sketches = self._result(self._send({'action': 'sketch', 'name': src, 'sketch': sketch,
+                                            'stages': stages}))
+        for other in sketches[1:]:
+            sketches[0].merge(other)
+        return sketches[0]
+
+    def sample(self, dataset, fraction, seed=None, inplace=True):
+        """
+        Keep every item with the probability `fraction`. It is a narrow
+        operation, see `StandardOperation`.
+
+        Parameters
+        ----------
+        seed: Optional[int]
+            the same seed keeps the same items, a random one by default
+
+        Returns
+        -------
+        Distributed
+        """
+        if not 0 <= fraction <= 1:
+            raise ValueError("The fraction must be in [0, 1], got %s" % fraction)
+        if seed is None:
+            # drawn here, so that a recomputed dataset keeps the same items
+            seed = random.getrandbits(32)
+        return self.map_partitions_with_index(partial(sample_items, fraction, seed),
+                                              dataset, inplace=inplace)
+
     def remove(self, dataset):
         """
-        Remove the data from processes.
+        Remove the data from processes. Nothing is done if it is
+        removed already, e.g. freed once its handles were collected.
         """
-        with self.acquire():
+        with self.lock:
+            if dataset.name not in self.names:
+                return
+            # the lineage forgets it, like the freed ones, see `_remove_released`
             self._send({'action': 'remove_dataset', 'name': dataset.name})
-            self.names.remove(dataset.name)
+            self.names.discard(dataset.name)
     
     def exists(self, dataset):
         """
@@ -197,36 +1074,395 @@ class MRClient:
         """
         return dataset.name in self.names
 
+    def broadcast(self, value):
+        """
+        Send a read-only object to every process once, instead of
+        pickling it with every function that uses it.
+
+        The object is pickled only once, and large objects are
+        passed through shared memory.
+
+        Returns
+        -------
+        Broadcast
+            the handle to use in the functions instead of the object,
+            see `Broadcast.value`
+        """
+        broadcast = Broadcast(self, value=value)
+        message = encode(value)
+        try:
+            future = self._send({'action': 'add_broadcast', 'id': broadcast.id,
+                                 'message': message})
+        except BaseException:
+            release(message)
+            raise
+        # the segment is read by every process before they answer
+        future.add_done_callback(lambda future: release(message))
+        self.broadcasts.add(broadcast.id)
+        return broadcast
+
+    def unpersist(self, broadcast):
+        """
+        Remove a broadcast object from the processes. For a dataset,
+        drop the mark of `persist`, so that it is evicted before the
+        persisted ones, and evict it now if it can be recomputed.
+        """
+        if isinstance(broadcast, Distributed):
+            with self.lock:
+                name = broadcast.name
+                self.lineage.persisted.discard(name)
+                if (name in self.lineage.current and name not in self.lineage.evicted
+                        and self.lineage.plan(name) is not None):
+                    if self.stream is not None:
+                        self.stream.close()
+                    self._evict(name)
+            return broadcast
+        if broadcast.id in self.broadcasts:
+            self._send({'action': 'remove_broadcast', 'ids': [broadcast.id]})
+            self.broadcasts.discard(broadcast.id)
+
+    def reset(self):
+        """
+        Remove all the datasets and broadcasts from the processes,
+        which are kept running. The handles of the datasets must not be
+        used afterwards.
+        """
+        with self.lock:
+            if self.broadcasts:
+                self._send({'action': 'remove_broadcast', 'ids': list(self.broadcasts)})
+                self.broadcasts.clear()
+            self._send({'action': 'reset'})
+            self.wait()
+            self.names.clear()
+            self.lineage = Lineage()
+
     def terminate(self):
         """
-        Terminate the processes.
+        Terminate the processes, after the functions submitted
+        and the commands sent have finished. The processes of a pool
+        given to the client are kept, and only reset.
         """
-        with self.acquire():
-            self._send({'action': 'terminate'})
+        self.executor.shutdown()
+        if self.own_pool:
+            with self.lock:
+                if self.broadcasts:
+                    self._send({'action': 'remove_broadcast', 'ids': list(self.broadcasts)})
+                    self.broadcasts.clear()
+                self.wait()
+        else:
+            self.reset()
+        self.pool.release(self)
+        if self.own_pool:
+            self.pool.terminate()
         self.__terminated = True
+        # so that the client can be collected before the interpreter exits
+        atexit.unregister(self.__del__)
 
     def collect(self, dataset, remove=False):
         """
-        Collect the data from processes to the client.
+        Collect the data from processes to the client, in the
+        order of the processes.
         """
-        with self.acquire():
-            self._send({'action': 'collect', 'name': dataset.name})
-            data = []
-            for item in robust_recv(self.global_queue, retries=3):
-                data.extend(item)
+        data = []
+        for batch in self.iter_collect(dataset, ordered=True):
+            data.extend(batch)
         if remove:
             self.remove(dataset)
         return data
 
+    def iter_collect(self, dataset, limit=None, ordered=False):
+        """
+        Collect the data from processes batch by batch.
+
+        At most `CONFIG.COLLECT_BUFFER` batches are on their way to the
+        client, the processes wait for the client to catch up before
+        sending more. The processes stop sending when the iterator
+        is closed, or another command is sent to them.
+
+        Parameters
+        ----------
+        limit: Optional[int]
+            the max number of items to send from every process
+        ordered: bool
+            whether to yield the batches of the first process first, and
+            so on, instead of in the order they arrive
+
+        Returns
+        -------
+        CollectStream
+            an iterator of the batches. The other threads cannot use the
+            client until it is exhausted or closed.
+        """
+        src, stages = dataset.plan()
+        dataset.wait()
+        return self._open_stream({'action': 'collect', 'name': src, 'stages': stages,
+                                  'limit': limit}, ordered)
+
+    def _open_stream(self, command, ordered):
+        """Send a command that streams batches back to the client"""
+        self.lock.acquire()
+        try:
+            future = self._send(command)
+        except BaseException:
+            self.lock.release()
+            raise
+        reader = StreamReader(self.global_queue, range(self.num_cores))
+        # the stream holds the lock until it is closed
+        self.stream = CollectStream(self, reader, future, ordered)
+        return self.stream
+
+    def take(self, dataset, n):
+        """
+        Returns
+        -------
+        list
+            the first `n` items in the order of the processes, the processes
+            stop sending as soon as there are enough of them
+        """
+        data = []
+        if n <= 0:
+            return data
+        stream = self.iter_collect(dataset, limit=n, ordered=True)
+        for batch in stream:
+            data.extend(batch)
+            if len(data) >= n:
+                break
+        stream.close()
+        return data[:n]
+
+    def first(self, dataset):
+        """
+        Returns
+        -------
+        object
+            the first item in the order of the processes
+        """
+        data = self.take(dataset, 1)
+        if not data:
+            raise ValueError("Dataset `%s` is empty" % dataset.name)
+        return data[0]
+
     def __del__(self):
         if not self.__terminated:
             self.terminate()
 
 
+def choose_boundaries(samples, n):
+    """
+    Choose the keys that split the data into `n` ranges of about
+    the same size.
+
+    Parameters
+    ----------
+    samples: List[Tuple[int, list]]
+        the number of items and a sample of their keys, of every process
+
+    Returns
+    -------
+    list
+        n - 1 sorted keys
+    """
+    weighted = []
+    for count, keys in samples:
+        if keys:
+            weight = count / len(keys)
+            weighted.extend((key, weight) for key in keys)
+    if not weighted:
+        return []
+    weighted.sort(key=itemgetter(0))
+    total = sum(weight for _, weight in weighted)
+    boundaries = []
+    acc = 0
+    for key, weight in weighted:
+        acc += weight
+        if acc >= total * (len(boundaries) + 1) / n and len(boundaries) < n - 1:
+            boundaries.append(key)
+    return boundaries
+
+
+def find_hot_keys(samples, n):
+    """
+    Find the keys that make up too much of the data to be sent to a
+    single process.
+
+    The number of items of every key is estimated from the samples. A
+    key is hot if it alone makes `HOT_KEY_LOAD` of the mean load of a
+    process, and it is spread over enough processes to bring it under
+    that share, starting from the process of its hash.
+
+    Parameters
+    ----------
+    samples: List[Tuple[int, list]]
+        the number of items and a sample of their keys, of every process
+
+    Returns
+    -------
+    Tuple[dict, dict]
+        the processes of every hot key, and the skew statistics: the
+        number of `records`, the estimated number of items of the
+        `hot_keys`, the `imbalance` of the processes (the largest load
+        over the mean one) when partitioned by hash, and the
+        `balanced_imbalance` once the hot keys are spread
+    """
+    counts = Counter()
+    total = 0
+    for count, keys in samples:
+        total += count
+        if keys:
+            weight = count / len(keys)
+            for key in keys:
+                counts[key] += weight
+    limit = total / n * HOT_KEY_LOAD
+    keys = list(counts)
+    hashed = [0.0] * n
+    balanced = [0.0] * n
+    hot = {}
+    for key, home in zip(keys, partition_keys(keys, n)):
+        count = counts[key]
+        hashed[home] += count
+        if count > limit and n > 1:
+            ways = min(n, math.ceil(count / limit))
+            hot[key] = [(home + i) % n for i in range(ways)]
+            for i in hot[key]:
+                balanced[i] += count / ways
+        else:
+            balanced[home] += count
+    mean = total / n or 1
+    stats = {'records': total, 'hot_keys': {key: round(counts[key]) for key in hot},
+             'imbalance': max(hashed) / mean if total else 1.0,
+             'balanced_imbalance': max(balanced) / mean if total else 1.0}
+    return hot, stats
+
+
+class CollectStream:
+    """
+    The batches sent by the processes for `MRClient.iter_collect`.
+    """
+    def __init__(self, client, reader, future, ordered=False):
+        self.client = client
+        self.reader = reader
+        self.future = future
+        self.batches = reader.ordered() if ordered else iter(reader)
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.batches)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        """
+        Stop the processes from sending the rest of the data, and
+        wait for them to finish the command.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if not self.reader.finished:
+                self.client.stop.set()
+                self.reader.drain()
+                self.client.stop.clear()
+            self.client.stream = None
+            self.client._result(self.future)
+        finally:
+            self.client.lock.release()
+
+
 class Distributed:
-    def __init__(self, client, name):
+    """
+    A handle of a dataset on the processes.
+
+    Narrow operations (map, filter, flatmap, map_partitions) only record
+    themselves as the `stage` of a new dataset whose `parent` is this one.
+    Actions (collect, count, reduce, partition, ...) run all the pending stages
+    since the last materialized ancestor in a single pass, and nothing
+    in between is stored unless `persist` is called.
+
+    The operations that make a dataset on the processes return as soon
+    as their commands are sent, and `futures` holds the answers to the
+    commands the dataset depends on. Actions wait for them first, so
+    that the error of the command that failed is raised.
+
+    The data are removed from the processes once all the handles of
+    the dataset (and of the ones made from it in place) are collected.
+    """
+    def __init__(self, client, name, parent=None, stage=None, futures=()):
         self.name = name
         self.client = client
+        self.parent = parent
+        self.stage = stage
+        self.materialized = parent is None
+        self.futures = list(futures)
+        self.children = weakref.WeakSet()   # the lazy datasets made from this one
+        if parent is not None:
+            parent.children.add(self)
+        client._acquire(name)
+        weakref.finalize(self, client._release, name)
+
+    def _append(self, stage):
+        """
+        Record a narrow operation on this handle itself, as if it was
+        run in place. What the handle stood for so far becomes its
+        parent, and the datasets made from it earlier keep it.
+        """
+        if self.parent is not None:
+            self.parent.children.discard(self)
+        previous = type(self)(self.client, self.name, self.parent, self.stage, self.futures)
+        previous.materialized = self.materialized
+        for child in self.children:
+            child.parent = previous
+            previous.children.add(child)
+        self.children = weakref.WeakSet()
+        previous.children.add(self)
+        self.parent, self.stage = previous, stage
+        self.materialized = False
+        self.futures = []
+        return self
+
+    def dependencies(self):
+        """
+        Returns
+        -------
+        List[Future]
+            the answers to the commands this dataset depends on, which are
+            not known to have succeeded yet
+        """
+        if not self.materialized:
+            return self.parent.dependencies()
+        self.futures = [future for future in self.futures
+                        if not future.done() or future.exception() is not None]
+        return list(self.futures)
+
+    def wait(self):
+        """
+        Wait until the dataset is made on the processes, and raise
+        the error of the first command that failed making it.
+        """
+        for future in self.dependencies():
+            self.client._result(future)
+        return self
+
+    def done(self):
+        return all(future.done() for future in self.dependencies())
+
+    def plan(self):
+        """
+        Returns
+        -------
+        Tuple[str, tuple]
+            the name of the nearest materialized dataset and the stages
+            to run on it to get this dataset
+        """
+        if self.materialized:
+            return self.name, ()
+        src, stages = self.parent.plan()
+        return src, stages + (self.stage,)
 
     def map(self, func, inplace=True):
         return self.client.map(func, self, inplace=inplace)
@@ -237,26 +1473,134 @@ class Distributed:
     def filter(self, func, inplace=True):
         return self.client.filter(func, self, inplace=inplace)
 
+    def map_partitions(self, func, with_index=False, inplace=True):
+        """
+        Parameters
+        ----------
+        func: Iterator -> Iterable
+            maps an iterator of the items of every process to the new
+            items, it can be a generator. Setup work such as compiling
+            a regex is done once per process instead of once per item.
+        with_index: bool
+            call `func(index, iterator)` with the index of the process instead
+        """
+        if with_index:
+            return self.client.map_partitions_with_index(func, self, inplace=inplace)
+        return self.client.map_partitions(func, self, inplace=inplace)
+
+    def foreach_partition(self, func, with_index=False):
+        return self.client.foreach_partition(func, self, with_index=with_index)
+
+    def save_as_text(self, directory, compression=None, encoding="utf-8", overwrite=False):
+        return self.client.save_as_text(self, directory, compression=compression,
+                                        encoding=encoding, overwrite=overwrite)
+
+    def save_as_jsonl(self, directory, compression=None, overwrite=False):
+        return self.client.save_as_jsonl(self, directory, compression=compression,
+                                         overwrite=overwrite)
+
+    def save_as_pickle(self, directory, compression=None, overwrite=False):
+        return self.client.save_as_pickle(self, directory, compression=compression,
+                                          overwrite=overwrite)
+
     def reduce(self, func, inplace=True):
         return self.client.reduce(func, self, inplace=inplace)
 
     def reduce2(self, func, inplace=True):
         return self.client.reduce2(func, self, inplace=inplace)
 
+    def combine_by_key(self, create_combiner, merge_value, merge_combiners, inplace=True):
+        return self.client.combine_by_key(create_combiner, merge_value, merge_combiners,
+                                          self, inplace=inplace)
+
+    def aggregate_by_key(self, zero, seq_op, comb_op, inplace=True):
+        return self.client.aggregate_by_key(zero, seq_op, comb_op, self, inplace=inplace)
+
     def partition(self, by=None):
         return self.client.partition(self, by=by)
 
+    def sort_by_key(self, key=None, ascending=True, inplace=True):
+        return self.client.sort_by_key(self, key=key, ascending=ascending, inplace=inplace)
+
+    def join(self, other, broadcast=False, skew=False):
+        return self.client.join(self, other, broadcast=broadcast, skew=skew)
+
+    def left_join(self, other, broadcast=False, skew=False):
+        return self.client.left_join(self, other, broadcast=broadcast, skew=skew)
+
+    def key_skew(self, by=None):
+        return self.client.key_skew(self, by=by)
+
+    def cogroup(self, other):
+        return self.client.cogroup(self, other)
+
     def exists(self):
         return self.client.exists(self)
 
     def count(self):
         return self.client.count(self)
 
+    def count_approx_distinct(self, precision=12):
+        return self.client.count_approx_distinct(self, precision=precision)
+
+    def approx_quantiles(self, quantiles, k=200):
+        return self.client.approx_quantiles(self, quantiles, k=k)
+
+    def top_k(self, k, capacity=None):
+        return self.client.top_k(self, k, capacity=capacity)
+
+    def sample(self, fraction, seed=None, inplace=True):
+        return self.client.sample(self, fraction, seed=seed, inplace=inplace)
+
     def collect(self):
         return self.client.collect(self)
 
+    def iter_collect(self, limit=None, ordered=False):
+        return self.client.iter_collect(self, limit=limit, ordered=ordered)
+
+    def take(self, n):
+        return self.client.take(self, n)
+
+    def first(self):
+        return self.client.first(self)
+
     def remove(self):
         return self.client.remove(self)
 
     def copy(self):
         return self.client.copy(self)
+
+    def persist(self, balance=False):
+        return self.client.persist(self, balance=balance)
+
+    def unpersist(self):
+        return self.client.unpersist(self)
+
+
+class ArrayDistributed(Distributed):
+    """
+    A handle of a dataset of numpy arrays on the processes, see
+    `MRClient.distribute_array`.
+
+    The operations here run on the whole chunk of every process at once.
+    The operations of `Distributed` are run row by row and make
+    ordinary datasets.
+    """
+    def map_partitions(self, func, with_index=False, inplace=True):
+        return self.client.map_array(func, self, with_index=with_index, inplace=inplace)
+
+    def filter_mask(self, func, inplace=True):
+        return self.client.filter_mask(func, self, inplace=inplace)
+
+    def sum(self, column=None):
+        return self.client.sum_array(self, column=column)
+
+    def group_aggregate(self, key, value=None, how='sum'):
+        return self.client.group_aggregate(self, key, value=value, how=how)
+
+    def collect(self):
+        return self.client.collect_array(self)
+
+    def save_as_npy(self, directory, compression=None, overwrite=False):
+        return self.client.save_as_npy(self, directory, compression=compression,
+                                       overwrite=overwrite)
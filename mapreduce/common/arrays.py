@@ -0,0 +1,142 @@
+"""
+Helpers of the datasets of NumPy arrays, see `MRClient.distribute_array`.
+
+A dataset of arrays is kept as one contiguous chunk per process. A table
+of columns is kept as a structured array, with one field per column.
+"""
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# the partial results computed by every process for each aggregation,
+# and the ufunc merging them
+AGGREGATIONS = {
+    'sum': ('sum',),
+    'count': ('count',),
+    'min': ('min',),
+    'max': ('max',),
+    'mean': ('sum', 'count'),
+}
+_UFUNCS = {
+    'sum': 'add',
+    'count': 'add',
+    'min': 'minimum',
+    'max': 'maximum',
+}
+
+
+def as_array(data):
+    """
+    Parameters
+    ----------
+    data: Union[numpy.ndarray, Dict[str, array_like]]
+        an array, or a table given as columns of the same length
+
+    Returns
+    -------
+    numpy.ndarray
+        the array, or a structured array with a field for every column
+    """
+    if np is None:
+        raise ImportError("NumPy is required by the datasets of arrays")
+    if isinstance(data, dict):
+        columns = [np.asarray(column) for column in data.values()]
+        lengths = set(len(column) for column in columns)
+        if len(lengths) > 1:
+            raise ValueError("The columns have different lengths: %s" % sorted(lengths))
+        dtype = [(name, column.dtype, column.shape[1:])
+                 for name, column in zip(data, columns)]
+        array = np.empty(lengths.pop() if lengths else 0, dtype=dtype)
+        for name, column in zip(data, columns):
+            array[name] = column
+    else:
+        array = np.ascontiguousarray(data)
+    check_array(array)
+    return array
+
+
+def check_array(array):
+    if not isinstance(array, np.ndarray):
+        raise TypeError("Expect a numpy array, got `%s`" % type(array).__name__)
+    if array.dtype.hasobject:
+        raise TypeError("Arrays of python objects are not supported, use `distribute`")
+    if not array.ndim:
+        raise ValueError("Expect an array of at least one dimension")
+
+
+def select(array, column):
+    """
+    Parameters
+    ----------
+    column: Union[str, callable]
+        the name of a field, or a function that maps the array to a column
+    """
+    if column is None:
+        return array
+    if callable(column):
+        return np.asarray(column(array))
+    return array[column]
+
+
+def _group(keys):
+    """
+    Returns
+    -------
+    Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]
+        the sorted unique keys, the order that sorts the keys, and
+        where every group starts in the sorted keys
+    """
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    if not len(keys):
+        return keys, order, np.zeros(0, dtype=np.intp)
+    starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+    return keys[starts], order, starts
+
+
+def _reduce(part, values, order, starts):
+    if not len(starts):
+        return values[:0]
+    return getattr(np, _UFUNCS[part]).reduceat(values[order], starts)
+
+
+def partial_aggregate(keys, values, how):
+    """
+    Aggregate the values by key within one process.
+
+    Returns
+    -------
+    Tuple[numpy.ndarray, list]
+        the unique keys, and the partial results of `AGGREGATIONS[how]`
+    """
+    if how not in AGGREGATIONS:
+        raise ValueError("Unknown aggregation `%s`" % how)
+    unique, order, starts = _group(keys)
+    parts = []
+    for part in AGGREGATIONS[how]:
+        if part == 'count':
+            parts.append(np.diff(np.append(starts, len(keys))))
+        else:
+            parts.append(_reduce(part, values, order, starts))
+    return unique, parts
+
+
+def merge_aggregates(partials, how):
+    """
+    Merge the results of `partial_aggregate` of every process.
+
+    Returns
+    -------
+    Tuple[numpy.ndarray, numpy.ndarray]
+        the sorted unique keys, and the aggregated value of every key
+    """
+    keys = np.concatenate([unique for unique, _ in partials])
+    unique, order, starts = _group(keys)
+    parts = []
+    for i, part in enumerate(AGGREGATIONS[how]):
+        values = np.concatenate([columns[i] for _, columns in partials])
+        parts.append(_reduce(part, values, order, starts))
+    if how == 'mean':
+        return unique, parts[0] / parts[1]
+    return unique, parts[0]
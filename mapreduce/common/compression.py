@@ -0,0 +1,110 @@
+"""
+Compression of the batches sent through the queues.
+
+The pickle of a batch is compressed by the codec of `CONFIG.COMPRESSION`
+if it is at least `CONFIG.COMPRESSION_THRESHOLD` bytes, and sent as it
+is if that does not make it smaller. zlib and lzma are always there,
+lz4 and zstd if their packages are installed.
+
+In the 'auto' mode, the fastest codec installed is used, and the time
+it takes is weighed against the time the saved bytes would take
+through a queue, over every `TRIAL_BATCHES` batches. Compression is
+turned off when it does not pay, and tried again after `RETRY_BATCHES`
+batches, as the data may have changed.
+"""
+import zlib
+import lzma
+from functools import partial
+from collections import namedtuple
+from time import perf_counter
+
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+PIPE_BANDWIDTH = 2 ** 29    # bytes per second through a queue, which compression saves time of
+TRIAL_BATCHES = 16          # number of batches compressed before deciding whether it pays
+RETRY_BATCHES = 1024        # number of batches sent as they are before trying again
+AUTO_CODECS = ('lz4', 'zstd', 'zlib')   # the codecs of the 'auto' mode, fastest first
+
+Compressed = namedtuple('Compressed', ['codec', 'data', 'size'])
+
+CODECS = {
+    'zlib': (partial(zlib.compress, level=1), zlib.decompress),
+    'lzma': (partial(lzma.compress, preset=0), lzma.decompress),
+}
+if lz4 is not None:
+    CODECS['lz4'] = (lz4.compress, lz4.decompress)
+if zstd is not None:
+    CODECS['zstd'] = (zstd.ZstdCompressor(level=1).compress, zstd.ZstdDecompressor().decompress)
+
+
+class Compressor:
+    """
+    Parameters
+    ----------
+    codec: str
+        one of `CODECS`, 'none' or 'auto'
+    threshold: int
+        the batches smaller than this number of bytes are not compressed
+    """
+    def __init__(self, codec, threshold):
+        self.adaptive = codec == 'auto'
+        if self.adaptive:
+            codec = next(name for name in AUTO_CODECS if name in CODECS)
+        elif codec in (None, '', 'none'):
+            codec = None
+        elif codec not in CODECS:
+            raise ValueError("Unknown codec `%s`, or its package is not installed" % codec)
+        self.codec = codec
+        self.threshold = threshold
+        self.enabled = True
+        self.skipped = 0
+        self.trial = [0, 0, 0, 0.0]     # batches, bytes in, bytes out and seconds
+
+    def compress(self, data):
+        """
+        Returns
+        -------
+        Optional[Compressed]
+            the compressed data, or None if they are to be sent as they are
+        """
+        if self.codec is None or len(data) < self.threshold:
+            return None
+        if not self.enabled:
+            self.skipped += 1
+            if self.skipped < RETRY_BATCHES:
+                return None
+            self.enabled = True
+            self.skipped = 0
+        start = perf_counter()
+        compressed = CODECS[self.codec][0](data)
+        if self.adaptive:
+            self._learn(len(data), len(compressed), perf_counter() - start)
+        if len(compressed) >= len(data):
+            return None
+        return Compressed(self.codec, compressed, len(data))
+
+    def _learn(self, size, compressed, seconds):
+        trial = self.trial
+        trial[0] += 1
+        trial[1] += size
+        trial[2] += compressed
+        trial[3] += seconds
+        if trial[0] < TRIAL_BATCHES:
+            return
+        saved = (trial[1] - trial[2]) / PIPE_BANDWIDTH
+        # plus decompressing, which takes about half as long
+        self.enabled = saved > 1.5 * trial[3]
+        self.trial = [0, 0, 0, 0.0]
+
+
+def decompress(message):
+    """The data of a `Compressed` message"""
+    return CODECS[message.codec][1](message.data)
@@ -0,0 +1,313 @@
+"""
+Reading and writing of files by the server processes.
+
+The files are split into byte ranges, one per process, and every process
+reads its own range through `mmap`. A line belongs to the range where it
+starts, so a process skips the partial line at the start of its range,
+and finishes the line that runs over the end of it. A file compressed
+with gzip, bz2 or xz, known by its suffix, can not be split, and is
+read whole by a single process.
+
+Every process writes its items into its own `part-XXXXX` file. The file
+is written under a temporary name and renamed when it is complete, so
+that a reader never sees a partial file.
+"""
+import os
+import bz2
+import csv
+import glob
+import gzip
+import json
+import lzma
+import mmap
+from itertools import islice
+from .arrays import np
+from .storage import CHUNK_SIZE, dump_batch
+
+BLOCK_SIZE = 2 ** 22        # number of bytes split into lines at once
+WRITE_BUFFER = 2 ** 20      # buffer size of the files written
+
+EXTENSIONS = {
+    'text': '.txt',
+    'jsonl': '.jsonl',
+    'pickle': '.pkl',
+    'npy': '.npy',
+}
+COMPRESSIONS = {
+    None: ('', open),
+    'gzip': ('.gz', gzip.open),
+    'bz2': ('.bz2', bz2.open),
+    'xz': ('.xz', lzma.open),
+}
+
+
+def list_files(path):
+    """
+    Parameters
+    ----------
+    path: str
+        a file, a directory, or a glob pattern
+
+    Returns
+    -------
+    List[str]
+        the files, sorted. The files in a directory starting with `.`
+        or `_` are skipped.
+    """
+    if os.path.isdir(path):
+        paths = [os.path.join(path, name) for name in os.listdir(path)
+                 if not name.startswith((".", "_"))]
+    else:
+        paths = glob.glob(path)
+    paths = sorted(p for p in paths if os.path.isfile(p))
+    if not paths:
+        raise FileNotFoundError("No file matches `%s`" % path)
+    return paths
+
+
+def compression_of(path):
+    """The compression of a file by its suffix, see `COMPRESSIONS`"""
+    for compression, (suffix, _) in COMPRESSIONS.items():
+        if compression is not None and path.endswith(suffix):
+            return compression
+    return None
+
+
+def split_ranges(paths, n):
+    """
+    Split files into `n` byte ranges of about the same size. A compressed
+    file is a single range, of the process where it starts.
+
+    Returns
+    -------
+    List[List[Tuple[str, int, int]]]
+        the (path, start, end) ranges of every process
+    """
+    sizes = [os.path.getsize(path) for path in paths]
+    chunk = -(-sum(sizes) // n) or 1
+    ranges = [[] for _ in range(n)]
+    offset = 0
+    for path, size in zip(paths, sizes):
+        start = offset
+        if compression_of(path) is not None:
+            ranges[min(start // chunk, n - 1)].append((path, 0, size))
+            start = offset + size
+        while start < offset + size:
+            i = start // chunk
+            end = min((i + 1) * chunk, offset + size)
+            ranges[i].append((path, start - offset, end - offset))
+            start = end
+        offset += size
+    return ranges
+
+
+def read_blocks(path, start, end):
+    """
+    Yields
+    ------
+    bytes
+        blocks of the lines that start in [start, end) of the file,
+        without the last line break, "\n" or "\r\n". A compressed
+        file is read whole.
+    """
+    compression = compression_of(path)
+    if compression is not None:
+        if start == 0:
+            yield from _read_compressed(path, compression)
+        return
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if start >= size:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            if start > 0:
+                # the line before belongs to the previous range
+                start = view.find(b"\n", start - 1) + 1
+                if not start:
+                    return
+            pos = start
+            while pos < end and pos < size:
+                stop = min(pos + BLOCK_SIZE, size)
+                if stop >= end:
+                    # finish the line that starts before the end
+                    last = view.find(b"\n", end - 1)
+                elif stop < size:
+                    # cut after the last line break, or the end of a long line
+                    last = view.rfind(b"\n", pos, stop)
+                    if last < 0:
+                        last = view.find(b"\n", stop)
+                else:
+                    last = -1
+                stop = size if last < 0 else last + 1
+                block = view[pos:stop]
+                pos = stop
+                yield _strip_break(block)
+
+
+def _read_compressed(path, compression):
+    with COMPRESSIONS[compression][1](path, "rb") as file:
+        rest = b""
+        while 1:
+            data = file.read(BLOCK_SIZE)
+            if not data:
+                if rest:
+                    yield rest
+                return
+            data = rest + data
+            last = data.rfind(b"\n")
+            if last < 0:
+                rest = data
+                continue
+            rest = data[last + 1:]
+            yield _strip_break(data[:last + 1])
+
+
+def _strip_break(block):
+    if block.endswith(b"\r\n"):
+        return block[:-2]
+    if block.endswith(b"\n"):
+        return block[:-1]
+    return block
+
+
+def _lines(path, start, end, encoding):
+    for block in read_blocks(path, start, end):
+        text = block.decode(encoding)
+        if "\r" in text:
+            text = text.replace("\r\n", "\n")
+        yield from text.split("\n")
+
+
+def read_text(path, start, end, encoding="utf-8"):
+    return _lines(path, start, end, encoding)
+
+
+def read_jsonl(path, start, end, encoding="utf-8"):
+    for line in _lines(path, start, end, encoding):
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_csv(path, start, end, encoding="utf-8", header=False, **fmtparams):
+    """
+    Yields
+    ------
+    Union[list, dict]
+        the rows, as dicts keyed by the first line of the file if `header`
+
+    Note that a quoted field must not hold a line break, as the file is
+    split on line breaks.
+    """
+    rows = csv.reader(_lines(path, start, end, encoding), **fmtparams)
+    if not header:
+        yield from rows
+        return
+    if start == 0:
+        names = next(rows, None)
+    else:
+        names = next(csv.reader(_lines(path, 0, 1, encoding), **fmtparams), None)
+    for row in rows:
+        yield dict(zip(names, row))
+
+
+READERS = {
+    'text': read_text,
+    'jsonl': read_jsonl,
+    'csv': read_csv,
+}
+
+
+def part_name(ith, format, compression=None):
+    return "part-%05d%s%s" % (ith, EXTENSIONS[format], COMPRESSIONS[compression][0])
+
+
+def remove_parts(directory):
+    """Remove the part files written into a directory before"""
+    for name in os.listdir(directory):
+        if name.startswith("part-"):
+            os.remove(os.path.join(directory, name))
+
+
+def write_text(file, items):
+    n = 0
+    items = iter(items)
+    while 1:
+        chunk = list(islice(items, CHUNK_SIZE))
+        if not chunk:
+            return n
+        file.write("".join("%s\n" % (item,) for item in chunk).encode(file.encoding))
+        n += len(chunk)
+
+
+def write_jsonl(file, items):
+    return write_text(file, (json.dumps(item) for item in items))
+
+
+def write_pickle(file, items):
+    """Pickled lists of items, which `storage.load_batches` reads back"""
+    n = 0
+    items = iter(items)
+    while 1:
+        chunk = list(islice(items, CHUNK_SIZE))
+        if not chunk:
+            return n
+        dump_batch(chunk, file)
+        n += len(chunk)
+
+
+def write_npy(file, array):
+    np.save(file, array)
+    return len(array)
+
+
+WRITERS = {
+    'text': write_text,
+    'jsonl': write_jsonl,
+    'pickle': write_pickle,
+    'npy': write_npy,
+}
+
+
+class _EncodedFile:
+    """A binary file, with the encoding of the text written into it"""
+    def __init__(self, file, encoding):
+        self.file = file
+        self.encoding = encoding
+        self.write = file.write
+
+
+def write_part(directory, ith, format, data, compression=None, encoding="utf-8"):
+    """
+    Write the data of a process into its part file of the directory.
+
+    Parameters
+    ----------
+    format: str
+        one of `WRITERS`
+    data: Union[Iterable, numpy.ndarray]
+        the items, or the array for 'npy'
+    compression: Optional[str]
+        None, 'gzip', 'bz2' or 'xz'
+
+    Returns
+    -------
+    Tuple[str, int]
+        the path of the file and the number of items written
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError("Unknown compression `%s`" % compression)
+    name = part_name(ith, format, compression)
+    path = os.path.join(directory, name)
+    # hidden, so that it is not read as a part of the output
+    temp = os.path.join(directory, ".%s.%d.tmp" % (name, os.getpid()))
+    try:
+        with open(temp, "wb", buffering=WRITE_BUFFER) as raw:
+            opener = COMPRESSIONS[compression][1]
+            with (raw if compression is None else opener(raw, "wb")) as file:
+                n = WRITERS[format](_EncodedFile(file, encoding), data)
+        os.replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+    return path, n
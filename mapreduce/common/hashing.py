@@ -0,0 +1,271 @@
+"""
+Stable hashing of partition keys.
+
+The builtin `hash` is salted per interpreter for str and bytes, so it
+is only the same in processes forked from one parent. The hashes here
+only depend on the value of the key, and keys that compare equal
+(e.g. `1`, `1.0` and `True`) get the same hash, so they always end up
+in the same partition.
+
+Dates and times, decimals, fractions, enums, complex numbers and UUIDs
+are hashed from their values too. Other keys fall back to the builtin
+`hash`, which `WorkerPool` makes the same in every process it starts.
+
+NumPy is used to hash batches of ints or floats at once if it is
+installed, and gives exactly the same result as the pure python path.
+"""
+import enum
+import uuid
+import struct
+import decimal
+import numbers
+import datetime
+from zlib import crc32
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MASK = 0xFFFFFFFFFFFFFFFF
+NONE_HASH = 0x5bd1e9955bd1e995
+_pack_double = struct.Struct("<d").pack
+_unpack_uint64 = struct.Struct("<Q").unpack
+
+
+def mix(x):
+    """The finalizer of splitmix64, spreads the bits of a 64-bit integer"""
+    x = ((x ^ (x >> 30)) * 0xbf58476d1ce4e5b9) & MASK
+    x = ((x ^ (x >> 27)) * 0x94d049bb133111eb) & MASK
+    return x ^ (x >> 31)
+
+
+def hash_int(key):
+    return mix(key & MASK)
+
+
+def hash_float(key):
+    if key.is_integer():
+        return mix(int(key) & MASK)
+    return mix(_unpack_uint64(_pack_double(key))[0])
+
+
+def hash_str(key):
+    return mix(crc32(key.encode("utf-8", "surrogatepass")))
+
+
+def hash_bytes(key):
+    return mix(crc32(key))
+
+
+def hash_tuple(key):
+    value = len(key)
+    for item in key:
+        value = mix((value * 0x100000001b3) & MASK ^ hash_key(item))
+    return value
+
+
+def hash_frozenset(key):
+    value = len(key)
+    for item in key:
+        value ^= hash_key(item)
+    return mix(value)
+
+
+def hash_none(key):
+    return NONE_HASH
+
+
+def hash_datetime(key):
+    if key.utcoffset() is not None:
+        # the aware datetimes of the same instant are equal
+        key = (key - key.utcoffset()).replace(tzinfo=datetime.timezone.utc)
+    return hash_str("datetime " + key.isoformat())
+
+
+def hash_date(key):
+    return hash_str("date " + key.isoformat())
+
+
+def hash_time(key):
+    return hash_str("time " + key.isoformat())
+
+
+def hash_timedelta(key):
+    return hash_tuple(("timedelta", key.days, key.seconds, key.microseconds))
+
+
+def hash_number(key):
+    """Decimals and fractions, hashed like the ints and floats they equal"""
+    if isinstance(key, decimal.Decimal) and not key.is_finite():
+        return hash_float(float(key))
+    if key == int(key):
+        return hash_int(int(key))
+    return hash_float(float(key))
+
+
+def hash_complex(key):
+    if not key.imag:
+        return hash_float(key.real)
+    return hash_tuple(("complex", key.real, key.imag))
+
+
+def hash_enum(key):
+    return hash_tuple((type(key).__module__, type(key).__qualname__, key.name))
+
+
+def hash_uuid(key):
+    return hash_int(key.int)
+
+
+_HASHERS = {
+    str: hash_str,
+    int: hash_int,
+    bool: hash_int,
+    float: hash_float,
+    tuple: hash_tuple,
+    bytes: hash_bytes,
+    bytearray: hash_bytes,
+    frozenset: hash_frozenset,
+    type(None): hash_none,
+    datetime.datetime: hash_datetime,
+    datetime.date: hash_date,
+    datetime.time: hash_time,
+    datetime.timedelta: hash_timedelta,
+    complex: hash_complex,
+    uuid.UUID: hash_uuid,
+}
+
+
+def hash_key(key):
+    """
+    Returns
+    -------
+    int
+        a 64-bit hash of the key, which is the same in every process
+    """
+    hasher = _HASHERS.get(type(key))
+    if hasher is not None:
+        return hasher(key)
+    # subclasses, e.g. numpy scalars and namedtuples
+    if isinstance(key, str):
+        return hash_str(key)
+    if isinstance(key, (bytes, bytearray, memoryview)):
+        return hash_bytes(bytes(key))
+    if isinstance(key, tuple):
+        return hash_tuple(key)
+    if isinstance(key, frozenset):
+        return hash_frozenset(key)
+    if isinstance(key, float):
+        return hash_float(key)
+    if hasattr(key, "__index__"):
+        return hash_int(key.__index__())
+    if isinstance(key, enum.Enum):
+        return hash_enum(key)
+    if isinstance(key, (numbers.Rational, decimal.Decimal)):
+        return hash_number(key)
+    if isinstance(key, complex):
+        return hash_complex(key)
+    if hasattr(key, "is_integer") and hasattr(key, "__float__"):
+        return hash_float(float(key))
+    for base in (datetime.datetime, datetime.date, datetime.time, datetime.timedelta, uuid.UUID):
+        if isinstance(key, base):
+            return _HASHERS[base](key)
+    # fall back to the builtin hash, which is only the same in processes
+    # with the same hash seed, see `WorkerPool.start`
+    return mix(hash(key) & MASK)
+
+
+def _mix_array(x):
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+
+def _hash_int_array(keys):
+    return _mix_array(keys.astype(np.int64, copy=False).view(np.uint64))
+
+
+def _hash_float_array(keys):
+    keys = keys.astype(np.float64, copy=False)
+    integral = np.isfinite(keys) & (keys == np.floor(keys))
+    if np.any(np.abs(keys[integral]) >= 2 ** 63):
+        return None
+    bits = keys.view(np.uint64).copy()
+    bits[integral] = keys[integral].astype(np.int64).view(np.uint64)
+    return _mix_array(bits)
+
+
+def hash_array(keys):
+    """
+    Hash a numpy array of ints, bools or floats.
+
+    Returns
+    -------
+    Optional[numpy.ndarray]
+        uint64 hashes, or None if the array cannot be hashed
+        in a vectorized way
+    """
+    kind = keys.dtype.kind
+    with np.errstate(over="ignore"):
+        if kind in "biu":
+            return _hash_int_array(keys)
+        if kind == "f":
+            return _hash_float_array(keys)
+    return None
+
+
+def _as_array(keys):
+    """Convert a batch of python ints or floats to an array, if possible"""
+    if not keys:
+        return None
+    first = type(keys[0])
+    if first is int:
+        if all(type(key) is int for key in keys):
+            try:
+                return np.array(keys, dtype=np.int64)
+            except OverflowError:
+                return None
+    elif first is float:
+        if all(type(key) is float for key in keys):
+            return np.array(keys, dtype=np.float64)
+    return None
+
+
+def hash_keys(keys):
+    """
+    Hash a batch of keys.
+
+    Parameters
+    ----------
+    keys: Union[list, numpy.ndarray]
+        the keys
+
+    Returns
+    -------
+    list
+        the 64-bit hash of every key, the same as `hash_key`
+    """
+    if np is not None:
+        array = keys if isinstance(keys, np.ndarray) else _as_array(keys)
+        if array is not None:
+            hashes = hash_array(array)
+            if hashes is not None:
+                return hashes.tolist()
+    return [hash_key(key) for key in keys]
+
+
+def partition_keys(keys, n):
+    """
+    Returns
+    -------
+    list
+        the partition in range(n) of every key
+    """
+    if np is not None:
+        array = keys if isinstance(keys, np.ndarray) else _as_array(keys)
+        if array is not None:
+            hashes = hash_array(array)
+            if hashes is not None:
+                return (hashes % np.uint64(n)).tolist()
+    return [hash_key(key) % n for key in keys]
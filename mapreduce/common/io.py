@@ -1,31 +1,204 @@
-from queue import Empty
+from .transport import Compressed, encode, decode, release, message_size
 
+CLIENT = -1  # the sender id of the client
 
-def robust_recv(queue, retries=3):
+# what the streams of this process have moved so far
+COUNTERS = {
+    'batches_sent': 0,
+    'records_sent': 0,
+    'bytes_sent': 0,
+    'batches_received': 0,
+    'records_received': 0,
+    'bytes_received': 0,
+    'batches_compressed': 0,
+    'bytes_saved': 0,
+}
+
+
+class StreamWriter:
+    """
+    Put batches into a queue as one stream.
+
+    Every batch is sent as `(sender, seq, batch)`, where `seq` counts
+    the batches of this stream, and the stream ends with a
+    `(sender, seq, None)` marker, so that the receiver knows when
+    it has got everything instead of guessing from timeouts.
+    The batches are encoded (and maybe compressed) by `transport.encode`,
+    and their size is reported to the `batcher` that cuts them, if any.
+    """
+    def __init__(self, queue, sender, batcher=None):
+        self.queue = queue
+        self.sender = sender
+        self.batcher = batcher
+        self.seq = 0
+
+    def put(self, batch):
+        message = encode(batch)
+        self.queue.put((self.sender, self.seq, message))
+        self.seq += 1
+        nbytes = message_size(message)
+        COUNTERS['batches_sent'] += 1
+        COUNTERS['records_sent'] += len(batch)
+        COUNTERS['bytes_sent'] += nbytes or 0
+        if isinstance(message, Compressed):
+            COUNTERS['batches_compressed'] += 1
+            COUNTERS['bytes_saved'] += message.size - nbytes
+        if self.batcher is not None and batch and nbytes is not None:
+            self.batcher.record(len(batch), nbytes)
+
+    def close(self):
+        self.queue.put((self.sender, self.seq, None))
+
+
+class StreamReader:
     """
-    Try to receive from a queue with retries
+    Receive batches from a queue until every sender has closed its stream
+
+    A sender may start its next stream, for the next command, before the
+    others have closed theirs. The batches of the senders that are not
+    read from, or have closed their stream already, are kept in the
+    `backlog` for the next reader of the queue.
 
     Parameters
     ----------
     queue: Queue
         the queue to receive from
-    retries: int
-        times of retry
-    
+    senders: Iterable[int]
+        the senders of the streams to receive
+    backlog: Optional[list]
+        the messages received from the queue but not read yet,
+        shared by the readers of the queue
+    """
+    def __init__(self, queue, senders, backlog=None):
+        self.queue = queue
+        self.senders = sorted(senders)
+        self.backlog = [] if backlog is None else backlog
+        self.closed = set()
+        self.expected = {}
+
+    @property
+    def finished(self):
+        return len(self.closed) >= len(self.senders)
+
+    def _readable(self, sender):
+        return sender not in self.closed and sender in self.expected
+
+    def _next(self):
+        for i, message in enumerate(self.backlog):
+            if self._readable(message[0]):
+                return self.backlog.pop(i)
+        while 1:
+            message = self.queue.get()
+            if self._readable(message[0]):
+                return message
+            self.backlog.append(message)
+
+    def _get(self):
+        if not self.expected:
+            self.expected = dict.fromkeys(self.senders, 0)
+        sender, seq, batch = self._next()
+        expected = self.expected[sender]
+        if seq != expected:
+            raise RuntimeError("Batch %d of sender %d is lost, got %d instead"
+                               % (expected, sender, seq))
+        self.expected[sender] = seq + 1
+        if batch is None:
+            self.closed.add(sender)
+        else:
+            COUNTERS['batches_received'] += 1
+            COUNTERS['bytes_received'] += message_size(batch) or 0
+        return sender, batch
+
+    def __iter__(self):
+        """
+        Yields
+        ------
+        list
+            the batches, in the order they are sent for every single sender
+        """
+        for sender, batch in self.events():
+            if batch is not None:
+                yield batch
+
+    def events(self):
+        """
+        Yields
+        ------
+        Tuple[int, Optional[list]]
+            the sender and the batch, or None when the sender closes its stream
+        """
+        while not self.finished:
+            sender, batch = self._get()
+            if batch is not None:
+                batch = decode(batch)
+                COUNTERS['records_received'] += len(batch)
+            yield sender, batch
+
+    def ordered(self):
+        """
+        Yields
+        ------
+        list
+            the batches of sender 0, then the ones of sender 1, etc.
+            The batches of the later senders are held back until
+            all the earlier ones have closed their streams.
+        """
+        pending = {sender: [] for sender in self.senders}
+        closed = set()
+        current = 0
+        for sender, batch in self.events():
+            if batch is None:
+                closed.add(sender)
+            else:
+                pending[sender].append(batch)
+            while current < len(self.senders):
+                sender = self.senders[current]
+                batches, pending[sender] = pending[sender], []
+                yield from batches
+                if sender not in closed:
+                    break
+                current += 1
+
+    def drain(self):
+        """Discard the rest of the streams"""
+        while not self.finished:
+            sender, batch = self._get()
+            if batch is not None:
+                release(batch)
+
+
+def send_stream(queue, sender, batches, stop=None, batcher=None):
+    """
+    Send all the batches as one stream. The end-of-stream marker
+    is sent even if producing the batches fails, so that the receiver
+    does not wait forever.
+
+    Parameters
+    ----------
+    stop: Optional[Event]
+        stop sending early once it is set by the receiver
+    batcher: Optional[Batcher]
+        the batcher that cuts the batches, see `StreamWriter`
+
     Returns
     -------
-    list
-        total data received
-    """
-    data = []
-    retry = 0
-    while 1:
-        try:
-            item = queue.get(True, timeout=0.01)
-            yield item
-            retry = 0
-        except Empty:
-            retry += 1
-            if retry >= 3:
+    int
+        number of batches sent
+    """
+    writer = StreamWriter(queue, sender, batcher)
+    try:
+        for batch in batches:
+            if stop is not None and stop.is_set():
                 break
-    return data
+            writer.put(batch)
+    finally:
+        writer.close()
+    return writer.seq
+
+
+def recv_stream(queue, senders, backlog=None):
+    """
+    Receive batches from a queue until every sender has closed its stream,
+    see `StreamReader`.
+    """
+    return iter(StreamReader(queue, senders, backlog))
@@ -1,26 +1,147 @@
-from inspect import isgenerator
+from collections.abc import Sequence
+from itertools import islice
+from time import perf_counter
+from .settings import CONFIG
+
+MIN_BATCH_BYTES = 2 ** 14   # the bounds of the target size of a batch
+MAX_BATCH_BYTES = 2 ** 22
+MAX_BATCH_ITEMS = 2 ** 16
+TUNING_WINDOW = 8           # number of batches the throughput is measured over
 
 
 def bufferize(iterable, buffer_size):
     """
-    Split data into multiple batches
+    Split data into multiple batches of `buffer_size` items. Sequences
+    are sliced, anything else is iterated without being materialized.
     """
-    def _bufferize_iterable(iterable, buffer_size):
-        buffer = []
-        for item in iterable:
-            buffer.append(item)
-            if len(buffer) >= buffer_size:
-                yield buffer
-                buffer = []
-        if buffer:
-            yield buffer
-
-    def _bufferize_sequence(iterable, buffer_size):
+    if isinstance(iterable, Sequence):
         for i in range(0, len(iterable), buffer_size):
-            batch = iterable[i:i+buffer_size]
+            yield iterable[i:i+buffer_size]
+        return
+    iterator = iter(iterable)
+    while 1:
+        batch = list(islice(iterator, buffer_size))
+        if not batch:
+            return
+        yield batch
+
+
+def make_batcher(spread=1):
+    """
+    Parameters
+    ----------
+    spread: int
+        number of streams the batches are spread over, see `Batcher`
+
+    Returns
+    -------
+    Batcher
+        a batcher configured by `CONFIG.BATCH_BYTES`, or one that cuts
+        batches of `CONFIG.BUFFER_SIZE` items if it is 0
+    """
+    if CONFIG.BATCH_BYTES:
+        return Batcher(CONFIG.BATCH_BYTES, spread=spread)
+    return FixedBatcher(CONFIG.BUFFER_SIZE)
+
+
+class FixedBatcher:
+    """Split data into batches of a fixed number of items"""
+    def __init__(self, size):
+        self.size = size
+
+    def batches(self, iterable):
+        return bufferize(iterable, self.size)
+
+    def record(self, items, nbytes):
+        pass
+
+
+class Batcher:
+    """
+    Split data into batches of about `target` bytes once pickled,
+    instead of a fixed number of items.
+
+    The size of an item is learnt from the batches that are sent, see
+    `record`, starting with a batch of a single item. The number of items
+    of a batch at most doubles after every `spread` batches, so that
+    small data spread over several streams still reaches all of them.
+    The target is tuned
+    by hill climbing on the measured throughput: every `TUNING_WINDOW`
+    batches it keeps moving (doubling or halving) in the direction that
+    made more bytes go through per second, and turns back otherwise.
+
+    Parameters
+    ----------
+    target: int
+        the initial size of a batch in bytes
+    spread: int
+        number of streams the batches are sent to
+    adaptive: bool
+        whether to tune the target
+    """
+    def __init__(self, target, spread=1, adaptive=True):
+        self.target = min(max(target, MIN_BATCH_BYTES), MAX_BATCH_BYTES)
+        self.spread = spread
+        self.adaptive = adaptive
+        self.ceiling = 1
+        self.recorded = 0
+        self.item_size = None
+        self.direction = 2
+        self.throughput = None
+        self.window = [0, 0]    # bytes and batches since the last tuning
+        self.started = perf_counter()
+
+    @property
+    def size(self):
+        """The number of items of the next batch"""
+        if self.item_size is None:
+            return 1
+        return int(min(max(self.target // self.item_size, 1), self.ceiling))
+
+    def batches(self, iterable):
+        """
+        Yields
+        ------
+        list
+            batches of the items
+        """
+        iterator = iter(iterable)
+        while 1:
+            batch = list(islice(iterator, self.size))
+            if not batch:
+                return
             yield batch
 
-    if isgenerator(iterable):
-        return _bufferize_iterable(iterable, buffer_size)
-    else:
-        return _bufferize_sequence(iterable, buffer_size)
+    def record(self, items, nbytes):
+        """
+        Learn from a batch that has been sent.
+
+        Parameters
+        ----------
+        items: int
+            number of items in the batch
+        nbytes: int
+            size of the batch once pickled
+        """
+        self.recorded += 1
+        if self.recorded % self.spread == 0:
+            self.ceiling = min(self.ceiling * 2, MAX_BATCH_ITEMS)
+        size = max(nbytes / items, 1)
+        if self.item_size is None:
+            self.item_size = size
+        else:
+            self.item_size = 0.75 * self.item_size + 0.25 * size
+        if not self.adaptive:
+            return
+        self.window[0] += nbytes
+        self.window[1] += 1
+        if self.window[1] < TUNING_WINDOW:
+            return
+        now = perf_counter()
+        throughput = self.window[0] / max(now - self.started, 1e-9)
+        if self.throughput is not None and throughput < self.throughput:
+            self.direction = 1 / self.direction
+        self.throughput = throughput
+        self.target = min(max(self.target * self.direction, MIN_BATCH_BYTES), MAX_BATCH_BYTES)
+        self.window = [0, 0]
+        self.started = now
@@ -0,0 +1,217 @@
+"""
+The lineage of the datasets, and the cache of the datasets on the processes.
+
+Every command that writes a dataset is a step of its lineage. A step
+has a token, and records the command, the tokens of the data it reads,
+and the token of the data it replaces if it writes in place. The data
+of a dataset whose steps can all be run again, i.e. it does not come
+from the client, can be evicted from the processes when they hold more
+than their budget, the least recently used first, and is recomputed
+from its lineage when it is used again, see `MRClient._send`.
+"""
+from collections import OrderedDict
+
+# the fields of the commands that name the datasets they read
+READS = {
+    'persist': ('src',),
+    'reduce': ('src',),
+    'combine_by_key': ('src',),
+    'partition': ('src',),
+    'sort': ('src',),
+    'hash_join': ('src', 'right'),
+    'cogroup': ('left', 'right'),
+    'map_array': ('src',),
+    'filter_mask': ('src',),
+    'collect': ('name',),
+    'collect_array': ('name',),
+    'count': ('name',),
+    'sample_keys': ('name',),
+    'sketch': ('name',),
+    'foreach_partition': ('name',),
+    'save': ('name',),
+    'sum_array': ('name',),
+    'group_aggregate': ('name',),
+}
+# the field of the commands that names the dataset they write
+WRITES = {
+    'add_dataset': 'name',
+    'add_array': 'name',
+    'read_files': 'name',
+    'persist': 'dest',
+    'reduce': 'dest',
+    'combine_by_key': 'dest',
+    'partition': 'dest',
+    'sort': 'dest',
+    'hash_join': 'dest',
+    'cogroup': 'dest',
+    'merge': 'dest',
+    'map_array': 'dest',
+    'filter_mask': 'dest',
+}
+# the commands whose data come from the client, they can not be run again
+SOURCES = {'add_dataset', 'add_array'}
+
+
+def reads(command):
+    """The names of the datasets a command reads"""
+    if command['action'] == 'merge':
+        return [name for name, _ in command['src']]
+    return [command[field] for field in READS.get(command['action'], ())
+            if command.get(field) is not None]
+
+
+def writes(command):
+    """The name of the dataset a command writes or removes, if any"""
+    if command['action'] == 'remove_dataset':
+        return command['name']
+    field = WRITES.get(command['action'])
+    return None if field is None else command[field]
+
+
+class Lineage:
+    """
+    The steps that made the datasets on the processes, their sizes,
+    and the order they were used in.
+    """
+    def __init__(self):
+        self.clock = 0
+        self.current = {}           # the token of the data of every dataset
+        self.steps = {}             # (command, tokens read, token replaced) of every token
+        self.sizes = {}             # the bytes of every dataset on every process
+        self.used = OrderedDict()   # the datasets, least recently used first
+        self.evicted = set()
+        self.persisted = set()
+
+    def record(self, command):
+        """Record a command sent to the processes"""
+        names = reads(command)
+        for name in names:
+            self._use(name)
+        dest = writes(command)
+        if dest is None:
+            return
+        if command['action'] == 'remove_dataset':
+            self.forget(dest)
+            return
+        self.clock += 1
+        replayable = command['action'] not in SOURCES and command.get('table') is None
+        self.steps[self.clock] = (
+            command if replayable else None,
+            {name: self.current.get(name) for name in names if name != dest},
+            self.current.get(dest) if dest in names else None,
+        )
+        self.current[dest] = self.clock
+        self.evicted.discard(dest)
+        self._use(dest)
+
+    def forget(self, name):
+        """Forget the data of a dataset removed from the processes"""
+        self.current.pop(name, None)
+        self.sizes.pop(name, None)
+        self.used.pop(name, None)
+        self.evicted.discard(name)
+        self.persisted.discard(name)
+
+    def _use(self, name):
+        if name in self.current:
+            self.used[name] = True
+            self.used.move_to_end(name)
+
+    def report(self, ith, sizes):
+        """
+        Parameters
+        ----------
+        sizes: Dict[str, Optional[int]]
+            the bytes of the datasets on process `ith` that changed
+            since its last report, None for the removed ones
+        """
+        for name, size in sizes.items():
+            if size is None:
+                self.sizes.get(name, {}).pop(ith, None)
+            elif name in self.current:
+                self.sizes.setdefault(name, {})[ith] = size
+
+    def usage(self):
+        """The bytes of the datasets that are not evicted, of every process"""
+        usage = {}
+        for name, by_process in self.sizes.items():
+            if name not in self.evicted:
+                for ith, size in by_process.items():
+                    usage[ith] = usage.get(ith, 0) + size
+        return usage
+
+    def plan(self, name):
+        """
+        Returns
+        -------
+        Optional[dict]
+            how to recompute the data of a dataset: the `commands` to
+            run, the evicted datasets they `restore` on the way, the
+            removed ones they make on the way and are to be removed
+            afterwards (`temps`), and all the datasets the plan
+            `touches`. None if it can not be recomputed.
+        """
+        plan = {'commands': [], 'restore': [], 'temps': [], 'touches': set()}
+        if not self._rebuild(self.current[name], name, plan, {name: self.current[name]}):
+            return None
+        return plan
+
+    def _rebuild(self, token, name, plan, pending):
+        command, sources, replaced = self.steps[token]
+        if command is None:
+            return False
+        if replaced is not None and not self._rebuild(replaced, name, plan, pending):
+            return False
+        for source, source_token in sources.items():
+            plan['touches'].add(source)
+            if source_token is None:
+                return False
+            if source in pending:
+                if pending[source] != source_token:
+                    return False
+                continue
+            current = self.current.get(source)
+            if current == source_token and source not in self.evicted:
+                continue
+            if current is not None and current != source_token:
+                # it holds other data now
+                return False
+            pending[source] = source_token
+            if not self._rebuild(source_token, source, plan, pending):
+                return False
+            plan['restore' if current is not None else 'temps'].append(source)
+        plan['commands'].append(command)
+        return True
+
+    def dependents(self, name):
+        """The evicted datasets that can only be recomputed from the current data of `name`"""
+        return [other for other in list(self.evicted)
+                if other != name and other in self.evicted
+                and name in (self.plan(other) or {}).get('touches', ())]
+
+    def victims(self, budget):
+        """
+        Mark the datasets to evict so that every process holds at most
+        `budget` bytes: the least recently used ones that can be
+        recomputed, and the persisted ones only if it is not enough.
+
+        Returns
+        -------
+        List[str]
+            the names of the datasets to remove from the processes
+        """
+        usage = self.usage()
+        victims = []
+        for persisted in (False, True):
+            for name in list(self.used):
+                if max(usage.values(), default=0) <= budget:
+                    return victims
+                if name in self.evicted or (name in self.persisted) != persisted:
+                    continue
+                if self.plan(name) is None:
+                    continue
+                self.evicted.add(name)
+                victims.append(name)
+                for ith, size in self.sizes.get(name, {}).items():
+                    usage[ith] -= size
+        return victims
@@ -0,0 +1,114 @@
+"""
+Serialization of the commands sent to the processes.
+
+A command is pickled once by the client and the same bytes are sent to
+every process. The functions in a command are pickled separately and
+referred to by the hash of their pickle, so a process that has already
+loaded a function, e.g. because the same `map` runs again, takes it from
+its `FunctionCache` instead of unpickling it.
+
+Note that a cached function is the same object every time it is used,
+so state kept in its closure is shared by the commands that use it.
+"""
+import io
+import pickle
+from hashlib import blake2b
+from collections import OrderedDict
+from types import FunctionType
+import dill
+
+FUNCTION_CACHE_SIZE = 256
+
+
+class _FunctionsByDigest:
+    """Pickle the functions separately, and keep only their digests"""
+    def persistent_id(self, obj):
+        if type(obj) is not FunctionType:
+            return None
+        # the globals it uses are pickled with it, as those of `__main__`
+        # made after the processes started are missing there
+        payload = dill.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL, recurse=True)
+        digest = blake2b(payload, digest_size=16).digest()
+        self.functions[digest] = payload
+        return digest
+
+
+class _CommandPickler(_FunctionsByDigest, pickle.Pickler):
+    def __init__(self, file, functions):
+        super(_CommandPickler, self).__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.functions = functions
+
+
+class _DillCommandPickler(_FunctionsByDigest, dill.Pickler):
+    def __init__(self, file, functions):
+        super(_DillCommandPickler, self).__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.functions = functions
+
+
+class _CommandUnpickler(dill.Unpickler):
+    def __init__(self, file, functions, cache):
+        super(_CommandUnpickler, self).__init__(file)
+        self.functions = functions
+        self.cache = cache
+
+    def persistent_load(self, digest):
+        return self.cache.load(digest, self.functions[digest])
+
+
+def dumps_command(command):
+    """
+    The command is pickled by the (fast) builtin pickler, or by dill if
+    it holds something else than functions that only dill can pickle.
+
+    Returns
+    -------
+    bytes
+        the pickled command
+    """
+    for pickler in (_CommandPickler, _DillCommandPickler):
+        functions = {}
+        file = io.BytesIO()
+        try:
+            pickler(file, functions).dump(command)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            if pickler is _DillCommandPickler:
+                raise
+        else:
+            break
+    return pickle.dumps((file.getvalue(), functions), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def loads_command(data, cache):
+    """
+    Parameters
+    ----------
+    data: bytes
+        a command pickled by `dumps_command`
+    cache: FunctionCache
+        the functions loaded before
+    """
+    body, functions = pickle.loads(data)
+    return _CommandUnpickler(io.BytesIO(body), functions, cache).load()
+
+
+class FunctionCache:
+    """The least recently used functions, by the hash of their pickle"""
+    def __init__(self, size=FUNCTION_CACHE_SIZE):
+        self.size = size
+        self.functions = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, digest, payload):
+        try:
+            func = self.functions[digest]
+        except KeyError:
+            self.misses += 1
+            func = dill.loads(payload)
+            self.functions[digest] = func
+            if len(self.functions) > self.size:
+                self.functions.popitem(last=False)
+        else:
+            self.hits += 1
+            self.functions.move_to_end(digest)
+        return func
@@ -179,23 +179,89 @@ class ConfigManager:
 
 
 
+# (key, default value, help text) of every setting
+DEFAULT_CONFIG = [
+    ("cores", 3, ""),
+    ("buffer_size", 32,
+     "number of items per batch, only used if batch_bytes is 0"),
+    ("batch_bytes", 65536,
+     "initial size of a batch in bytes, tuned by the measured throughput, 0 to batch by buffer_size"),
+    ("collect_buffer", 64,
+     "max number of batches on their way to the client, the processes wait when it is reached"),
+    ("cache_limit", 0,
+     "budget of the datasets of every process in MiB, the least recently used ones are removed beyond it and recomputed when used again, 0 for unlimited"),
+    ("compression", "none",
+     "codec of the batches sent between processes, auto turns it off when it does not pay, {none, zlib, lzma, lz4, zstd, auto}"),
+    ("compression_threshold", 16384,
+     "batches smaller than this number of bytes are not compressed"),
+    ("memory_limit", 0,
+     "memory budget of every process in MiB, datasets beyond it are spilled to disk, 0 for unlimited"),
+    ("shm_threshold", 262144,
+     "batches larger than this number of bytes are sent through shared memory, 0 to disable"),
+]
+
+
 def create_default_config():
     """Create default config file"""
     with open(CONFIG_PATH, "w") as config_file:
-        default_config = [
-            "cores = 3",
-            "buffer_size = 32",
-            "",
-        ]
+        default_config = []
+        for key, value, help_text in DEFAULT_CONFIG:
+            line = "%s = %s" % (key, value)
+            if help_text:
+                line += "  # " + help_text
+            default_config.append(line)
+        default_config.append("")
         config_file.write("\n".join(default_config))
 
 
+def add_missing_defaults(config):
+    """
+    Add the settings that are missing from the config file,
+    e.g. the ones introduced after the file was created.
+    """
+    for key, value, help_text in DEFAULT_CONFIG:
+        if key.upper() not in config:
+            config.add_argument("--%s" % key, default=value,
+                                type=type(value), help=help_text)
+
+
 def make_default_settings():
     """Create directories for data and configurations"""
     os.mkdir(MAIN_PATH)
     create_default_config()
 
 
-if not os.path.exists(MAIN_PATH):
-    make_default_settings()
-CONFIG = ConfigManager(os.path.join(MAIN_PATH, "config.cfg"))
+def load_config():
+    """Read the config file, creating it first if needed"""
+    if not os.path.exists(MAIN_PATH):
+        make_default_settings()
+    config = ConfigManager(CONFIG_PATH)
+    add_missing_defaults(config)
+    return config
+
+
+class LazyConfig:
+    """
+    The `ConfigManager` of the config file, loaded when first used,
+    so that importing the package neither touches the file system
+    nor parses the command line.
+    """
+    def __init__(self):
+        object.__setattr__(self, "_config", None)
+
+    def load(self):
+        if self._config is None:
+            object.__setattr__(self, "_config", load_config())
+        return self._config
+
+    def __getattr__(self, item):
+        return getattr(self.load(), item)
+
+    def __setattr__(self, key, value):
+        setattr(self.load(), key, value)
+
+    def __contains__(self, item):
+        return item in self.load()
+
+
+CONFIG = LazyConfig()
@@ -0,0 +1,214 @@
+"""
+Mergeable sketches of a dataset, for the approximate aggregations.
+
+Every process feeds its items into an empty sketch in one pass, see
+`MRServer.sketch`, and only the sketches are sent back to the client,
+which merges them. A sketch has `update(items)` for a batch of items,
+`merge(other)`, `reseed(index)`, called with the index of the process
+that fills it, and a method that answers from it.
+"""
+import math
+import heapq
+from random import Random
+from itertools import islice
+from collections import Counter
+from .hashing import hash_keys
+
+
+class HyperLogLog:
+    """
+    Count of the distinct items. The relative standard error is about
+    `1.04 / sqrt(2 ** precision)`, 1.6% by default, and the sketch
+    holds `2 ** precision` bytes.
+
+    Items that compare equal are counted once, as they have the same
+    hash, see `common.hashing`.
+    """
+    def __init__(self, precision=12):
+        if not 4 <= precision <= 18:
+            raise ValueError("The precision must be in [4, 18], got %s" % precision)
+        self.precision = precision
+        self.registers = bytearray(2 ** precision)
+
+    def reseed(self, index):
+        pass
+
+    def update(self, items):
+        registers = self.registers
+        shift = 64 - self.precision
+        low = (1 << shift) - 1
+        for value in hash_keys(items):
+            # the rank of the first bit set in the bits below the index
+            rank = shift - (value & low).bit_length() + 1
+            index = value >> shift
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Can not merge sketches of different precisions")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -rank for rank in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more accurate for the small counts
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class KLL:
+    """
+    Quantiles of comparable items, by the sketch of Karnin, Lang and
+    Liberty. The rank of an answer is off by about `1.7 / k` of the
+    number of items, 1% by default, and the sketch holds about `3 * k`
+    items.
+
+    The items are kept in compactors of increasing levels, an item of
+    level `h` standing for `2 ** h` items. A full compactor is sorted,
+    and every other item of it is moved one level up.
+    """
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.seed = Random().getrandbits(32) if seed is None else seed
+        self.rng = Random(self.seed)
+        self.compactors = [[]]
+        self.size = 0
+
+    def reseed(self, index):
+        # the processes compact independently, so that their errors average out
+        self.rng = Random("%s-%d" % (self.seed, index))
+
+    def _capacity(self, level):
+        depth = len(self.compactors) - level - 1
+        return max(int(math.ceil(self.k * (2 / 3) ** depth)), 2)
+
+    def update(self, items):
+        self.compactors[0].extend(items)
+        self.size = sum(map(len, self.compactors))
+        self._compress()
+
+    def merge(self, other):
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        for level, items in enumerate(other.compactors):
+            self.compactors[level].extend(items)
+        self.size = sum(map(len, self.compactors))
+        self._compress()
+        return self
+
+    def _compress(self):
+        while self.size >= sum(map(self._capacity, range(len(self.compactors)))):
+            for level, items in enumerate(self.compactors):
+                if len(items) >= self._capacity(level):
+                    if level + 1 == len(self.compactors):
+                        self.compactors.append([])
+                    items.sort()
+                    # an odd item out stays at this level
+                    kept = [items.pop()] if len(items) % 2 else []
+                    self.compactors[level + 1].extend(items[self.rng.random() < 0.5::2])
+                    self.size -= len(items) // 2
+                    items[:] = kept
+                    break
+
+    def quantiles(self, fractions):
+        """
+        Parameters
+        ----------
+        fractions: Iterable[float]
+            the ranks, from 0 to 1, of the items to find
+
+        Returns
+        -------
+        list
+            the items of the ranks, None if the sketch is empty
+        """
+        weighted = sorted((item, 2 ** level) for level, items in enumerate(self.compactors)
+                          for item in items)
+        total = sum(weight for _, weight in weighted)
+        result = []
+        for fraction in fractions:
+            if not 0 <= fraction <= 1:
+                raise ValueError("The quantiles must be in [0, 1], got %s" % fraction)
+            answer = weighted[-1][0] if weighted else None
+            rank = 0
+            for item, weight in weighted:
+                rank += weight
+                if rank >= fraction * total:
+                    answer = item
+                    break
+            result.append(answer)
+        return result
+
+
+class SpaceSaving:
+    """
+    The most frequent items, counted in at most `capacity` counters.
+
+    The counts over-estimate the true ones by at most `error`, which
+    is at most the number of items divided by `capacity`. Every item
+    that makes more than that share of the dataset is kept.
+    """
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = {}
+        self.error = 0      # the count of any item without a counter is at most this
+
+    def reseed(self, index):
+        pass
+
+    def update(self, items):
+        counts = Counter(items)
+        self._combine(counts, 0)
+
+    def merge(self, other):
+        self._combine(other.counts, other.error)
+        return self
+
+    def _combine(self, counts, error):
+        merged = {item: count + counts.get(item, error) for item, count in self.counts.items()}
+        for item, count in counts.items():
+            if item not in merged:
+                merged[item] = count + self.error
+        self.error += error
+        if len(merged) > self.capacity:
+            top = heapq.nlargest(self.capacity + 1, merged.items(), key=lambda pair: pair[1])
+            self.error = max(self.error, top.pop()[1])
+            merged = dict(top)
+        self.counts = merged
+
+    def top(self, k):
+        """
+        Returns
+        -------
+        List[Tuple[object, int]]
+            the `k` most frequent items and their counts, the most frequent first
+        """
+        return heapq.nlargest(k, self.counts.items(), key=lambda pair: pair[1])
+
+
+def sample_items(fraction, seed, index, items):
+    """
+    Keep every item with the probability `fraction`, skipping to the
+    next one kept instead of drawing a number for every item.
+    The same `seed` keeps the same items of process `index`.
+    """
+    if fraction <= 0:
+        return
+    if fraction >= 1:
+        yield from items
+        return
+    rng = Random("%s-%d" % (seed, index))
+    log = math.log(1 - fraction)
+    items = iter(items)
+    while 1:
+        skip = int(math.log(1 - rng.random()) / log)
+        for item in islice(items, skip, skip + 1):
+            yield item
+            break
+        else:
+            return
@@ -0,0 +1,131 @@
+"""
+Summaries of the events recorded for every command.
+
+Every process answers a command with an event: how long the command
+took, how much data it read, stored and moved, and how much memory the
+process uses. The client keeps the events of the commands it has sent,
+see `MRClient.stats` and `MRClient.export_trace`.
+"""
+import pstats
+
+# the fields of the events that are added up
+TOTALS = (
+    'duration', 'cpu', 'records_in', 'records_out', 'spilled',
+    'batches_sent', 'records_sent', 'bytes_sent',
+    'batches_received', 'records_received', 'bytes_received',
+    'batches_compressed', 'bytes_saved',
+    'function_hits', 'function_misses', 'idle', 'stolen',
+)
+
+
+def summarize(commands):
+    """
+    Parameters
+    ----------
+    commands: Iterable[dict]
+        the commands answered, with the `action`, the time it was `sent`
+        and `answered`, and the event of every process in `workers`
+
+    Returns
+    -------
+    Dict[str, dict]
+        for every action: the number of `commands`, the `wall` time of the
+        slowest process added up, the `TOTALS` of all processes, the
+        largest `memory` and `peak_rss` in bytes, and the mean and max
+        `imbalance`, which is the ratio of the slowest process to the
+        average one, the mean and max `skew`, the same ratio of the
+        numbers of items stored by the processes, and the `utilization`
+        of every process: the share of the wall time it was busy, not
+        done or waiting for work to steal
+    """
+    summary = {}
+    for command in commands:
+        events = command['workers']
+        stats = summary.setdefault(command['action'], dict(
+            {key: 0 for key in TOTALS}, commands=0, failed=0, wall=0.0,
+            memory=0, peak_rss=0, imbalance=0.0, max_imbalance=0.0,
+            skew=0.0, max_skew=0.0, utilization={}))
+        stats['commands'] += 1
+        stats['failed'] += any(event['failed'] for event in events)
+        durations = [event['duration'] for event in events]
+        stats['wall'] += max(durations)
+        mean = sum(durations) / len(durations)
+        imbalance = max(durations) / mean if mean else 1.0
+        stats['imbalance'] += imbalance
+        stats['max_imbalance'] = max(stats['max_imbalance'], imbalance)
+        stored = [event['records_out'] for event in events]
+        mean = sum(stored) / len(stored)
+        skew = max(stored) / mean if mean else 1.0
+        stats['skew'] += skew
+        stats['max_skew'] = max(stats['max_skew'], skew)
+        busy = stats['utilization']
+        for event in events:
+            busy[event['ith']] = busy.get(event['ith'], 0.0) + event['duration'] - event['idle']
+            for key in TOTALS:
+                stats[key] += event[key]
+            stats['memory'] = max(stats['memory'], event['memory'])
+            stats['peak_rss'] = max(stats['peak_rss'], event['peak_rss'])
+    for stats in summary.values():
+        stats['imbalance'] /= stats['commands']
+        stats['skew'] /= stats['commands']
+        stats['utilization'] = [stats['utilization'][ith] / stats['wall'] if stats['wall'] else 1.0
+                                for ith in sorted(stats['utilization'])]
+    return summary
+
+
+def chrome_trace(commands):
+    """
+    Returns
+    -------
+    dict
+        the commands in the Chrome trace event format, which can be opened
+        in chrome://tracing or Perfetto. Every process is a thread, and the
+        client is thread -1, spanning from sending a command until it reads
+        the answers.
+    """
+    events = [{'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': -1,
+               'args': {'name': 'client'}}]
+    threads = set()
+    for command in commands:
+        action = command['action']
+        events.append({'name': action, 'cat': 'client', 'ph': 'X', 'pid': 0, 'tid': -1,
+                       'ts': command['sent'] * 1e6,
+                       'dur': (command['answered'] - command['sent']) * 1e6})
+        for event in command['workers']:
+            threads.add(event['ith'])
+            args = {key: event[key] for key in TOTALS if key != 'duration'}
+            args['memory'] = event['memory']
+            events.append({'name': action, 'cat': 'process', 'ph': 'X', 'pid': 0,
+                           'tid': event['ith'], 'ts': event['start'] * 1e6,
+                           'dur': event['duration'] * 1e6, 'args': args})
+    for ith in sorted(threads):
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': ith,
+                       'args': {'name': 'process %d' % ith}})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+class _Profile:
+    """The profile of a process, in the form `pstats.Stats.add` takes"""
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def merge_profiles(profiles):
+    """
+    Parameters
+    ----------
+    profiles: Iterable[dict]
+        the `stats` of `cProfile.Profile`s
+
+    Returns
+    -------
+    pstats.Stats
+        the profiles added up
+    """
+    stats = pstats.Stats()
+    for profile in profiles:
+        stats.add(_Profile(profile))
+    return stats
@@ -0,0 +1,151 @@
+"""
+Work stealing between the server processes.
+
+The items of a process are split into tasks of `TASK_SIZE` items. A
+process runs its own tasks, and between two tasks it answers the
+requests of the idle processes by giving them its next task, items and
+all. Once it has run out of tasks, it steals from the others in turn,
+until they have all answered that they have none left.
+
+The processes talk through a queue each, with `(kind, round, sender,
+payload)` messages:
+
+- `STEAL` asks the receiver for a task
+- `TASK` answers a `STEAL` with the items of a task
+- `NONE` answers a `STEAL` when the receiver has no task left
+- `DONE` tells that the sender will not steal any more
+
+A process has to answer the requests of the others until it has got
+all their `DONE`s. The `round` tells apart the messages of consecutive
+commands, as a process may start stealing in the next command while
+another one still waits for the `DONE`s of this one.
+"""
+import time
+from queue import Empty
+from itertools import islice
+from .transport import encode, decode
+
+TASK_SIZE = 1024    # number of items of a task
+
+STEAL, TASK, NONE, DONE = range(4)
+
+
+class WorkStealer:
+    """
+    Parameters
+    ----------
+    ith: int
+        the index of this process
+    queues: List[Queue]
+        the queue of the messages of every process
+    round: int
+        the number of the command, counted the same way by all the processes
+    early: Optional[list]
+        the messages of the next rounds received so far, shared by the
+        stealers of the process
+    """
+    def __init__(self, ith, queues, round, early=None):
+        self.ith = ith
+        self.queues = queues
+        self.round = round
+        self.early = [] if early is None else early
+        self.tasks = iter(())
+        self.done = set()
+        self.error = None
+        self.idle = 0.0     # seconds spent waiting for a task or the others
+        self.stolen = 0     # number of tasks run for the others
+
+    def run(self, items, func):
+        """
+        Run `func` on the tasks of the items, and on the ones stolen
+        from the other processes. An error of `func` is raised once
+        the others are done, so that they are not left waiting.
+
+        Parameters
+        ----------
+        items: Iterable
+            the items of this process
+        func: list -> None
+            runs a task
+        """
+        n = len(self.queues)
+        try:
+            items = iter(items)
+            self.tasks = iter(lambda: list(islice(items, TASK_SIZE)), [])
+            for task in self.tasks:
+                func(task)
+                self._serve(block=False)
+        except Exception as e:
+            self._fail(e)
+        for i in range(1, n):
+            victim = (self.ith + i) % n
+            while self.error is None:
+                self._send(victim, STEAL)
+                task = self._wait(victim)
+                if task is None:
+                    break
+                try:
+                    func(task)
+                except Exception as e:
+                    self._fail(e)
+                self.stolen += 1
+        for i in range(n):
+            if i != self.ith:
+                self._send(i, DONE)
+        while len(self.done) < n - 1:
+            self._serve(block=True)
+        if self.error is not None:
+            raise self.error
+
+    def _fail(self, error):
+        self.error = error
+        self.tasks = iter(())
+
+    def _send(self, to, kind, payload=None):
+        self.queues[to].put((kind, self.round, self.ith, payload))
+
+    def _recv(self, block):
+        for i, message in enumerate(self.early):
+            if message[1] == self.round:
+                return self.early.pop(i)
+        while 1:
+            start = time.perf_counter()
+            try:
+                message = self.queues[self.ith].get(block)
+            except Empty:
+                return None
+            finally:
+                if block:
+                    self.idle += time.perf_counter() - start
+            if message[1] == self.round:
+                return message
+            self.early.append(message)
+
+    def _handle(self, message):
+        kind, _, sender, _ = message
+        if kind == STEAL:
+            task = next(self.tasks, None)
+            if task is None:
+                self._send(sender, NONE)
+            else:
+                self._send(sender, TASK, encode(task))
+        elif kind == DONE:
+            self.done.add(sender)
+        else:
+            raise RuntimeError("Unexpected message %d from process %d" % (kind, sender))
+
+    def _serve(self, block):
+        """Answer the requests received, waiting for one if `block`"""
+        message = self._recv(block)
+        while message is not None:
+            self._handle(message)
+            message = self._recv(False)
+
+    def _wait(self, victim):
+        """The task answered by `victim`, or None if it has none left"""
+        while 1:
+            message = self._recv(True)
+            kind, _, sender, payload = message
+            if sender == victim and kind in (TASK, NONE):
+                return None if kind == NONE else decode(payload)
+            self._handle(message)
@@ -0,0 +1,334 @@
+"""
+Storage of the datasets in a server process within a memory budget.
+
+Every dataset of a process is a `Partition`, which keeps its items in
+memory until the process goes over `CONFIG.MEMORY_LIMIT`. The largest
+partitions are then spilled into files of pickled batches under
+`SPILL_PATH`, and read back as a stream when they are iterated.
+The chunks of the datasets of arrays are `ArrayPartition`s, which are
+spilled as .npy files and memory-mapped when they are read back.
+"""
+import os
+import sys
+import pickle
+import shutil
+import tempfile
+import weakref
+from heapq import merge
+from itertools import islice
+import dill
+from .settings import MAIN_PATH
+from .hashing import hash_keys
+from .arrays import np
+
+SPILL_PATH = os.path.join(MAIN_PATH, "spill")
+CHUNK_SIZE = 1024   # number of items written or accounted at once
+SAMPLE_SIZE = 16    # number of items measured to estimate the size of a chunk
+NUM_BUCKETS = 64    # number of files the keys are split into by `combine`
+
+
+def sizeof(obj):
+    """The size of an object and the objects it directly holds"""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (tuple, list)):
+        size += sum(sys.getsizeof(item) for item in obj)
+    elif isinstance(obj, dict):
+        size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in obj.items())
+    return size
+
+
+def estimate_size(items):
+    """The size of a list of items, estimated from a sample of them"""
+    if not items:
+        return 0
+    step = max(1, len(items) // SAMPLE_SIZE)
+    sample = items[::step]
+    size = sum(sizeof(item) for item in sample)
+    # plus the pointer held by the list for every item
+    return size * len(items) // len(sample) + 8 * len(items)
+
+
+def dump_batch(batch, file):
+    try:
+        pickle.dump(batch, file, protocol=pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        dill.dump(batch, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_batches(path):
+    with open(path, "rb") as file:
+        while 1:
+            try:
+                yield pickle.load(file)
+            except EOFError:
+                return
+
+
+def remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class Storage:
+    """
+    The memory budget of a process, shared by all of its partitions.
+
+    Parameters
+    ----------
+    limit: int
+        the budget in bytes, 0 for unlimited
+    path: str
+        the directory of the spilled files
+    """
+    def __init__(self, limit, path):
+        self.limit = limit
+        self.path = path
+        self.partitions = weakref.WeakSet()
+        self.records = 0        # number of items stored so far
+        self.spilled = 0        # estimated bytes spilled so far
+
+    @property
+    def nbytes(self):
+        """Estimated size of the items held in memory"""
+        return sum(partition.nbytes for partition in self.partitions)
+
+    def available(self):
+        """The memory left for data that is not held by a partition"""
+        return max(self.limit - self.nbytes, self.limit // 4)
+
+    def partition(self, items=()):
+        """A new partition holding the items"""
+        partition = Partition(self)
+        self.partitions.add(partition)
+        partition.extend(items)
+        return partition
+
+    def array(self, array):
+        """A new partition holding a numpy array"""
+        partition = ArrayPartition(self, array)
+        self.partitions.add(partition)
+        self.records += len(array)
+        self.reserve()
+        return partition
+
+    def reserve(self):
+        """Spill the largest partitions until the budget is met"""
+        if not self.limit:
+            return
+        while self.nbytes > self.limit:
+            victim = max(self.partitions, key=lambda partition: partition.nbytes)
+            if not victim.nbytes:
+                break
+            victim.spill()
+
+    def new_file(self, suffix=".batch"):
+        """
+        Returns
+        -------
+        Tuple[file, str]
+            an opened binary file to spill into, and its path
+        """
+        os.makedirs(self.path, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=self.path, suffix=suffix)
+        return os.fdopen(fd, "wb"), path
+
+    def close(self):
+        """Remove all the spilled files"""
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class Partition:
+    """
+    The items of one dataset on one process, in memory or spilled.
+    The files are removed when the partition is garbage collected.
+    """
+    def __init__(self, storage):
+        self.storage = storage
+        self.memory = []
+        self.files = []
+        self.length = 0
+        self.nbytes = 0     # estimated size of the items held in memory
+        self.size = 0       # estimated size of all the items
+        weakref.finalize(self, remove_files, self.files)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        # later spills must not change what is being iterated
+        files, memory = list(self.files), self.memory
+        for path in files:
+            for batch in load_batches(path):
+                yield from batch
+        yield from memory
+
+    def extend(self, items):
+        items = iter(items)
+        while 1:
+            chunk = list(islice(items, CHUNK_SIZE))
+            if not chunk:
+                break
+            self.memory.extend(chunk)
+            self.length += len(chunk)
+            self.storage.records += len(chunk)
+            nbytes = estimate_size(chunk)
+            self.nbytes += nbytes
+            self.size += nbytes
+            self.storage.reserve()
+
+    def spill(self):
+        """Move the items held in memory into a file"""
+        if not self.memory:
+            return
+        file, path = self.storage.new_file()
+        self.files.append(path)
+        with file:
+            for i in range(0, len(self.memory), CHUNK_SIZE):
+                dump_batch(self.memory[i:i+CHUNK_SIZE], file)
+        self.storage.spilled += self.nbytes
+        self.memory = []
+        self.nbytes = 0
+
+
+class ArrayPartition:
+    """
+    The chunk of a dataset of arrays on one process, see `Partition`.
+    Iterating over it yields the rows of the array.
+    """
+    def __init__(self, storage, array):
+        self.storage = storage
+        self.array = array
+        self.files = []
+        self.nbytes = array.nbytes
+        self.size = array.nbytes
+        weakref.finalize(self, remove_files, self.files)
+
+    def __len__(self):
+        return len(self.array)
+
+    def __iter__(self):
+        return iter(self.array)
+
+    def spill(self):
+        """Move the array into a file, and map the file instead"""
+        if not self.nbytes:
+            return
+        file, path = self.storage.new_file(suffix=".npy")
+        self.files.append(path)
+        with file:
+            np.save(file, self.array)
+        self.storage.spilled += self.nbytes
+        self.array = np.load(path, mmap_mode="r")
+        self.nbytes = 0
+
+
+_missing = object()
+
+
+def combine(dataset, create_combiner, merge_value, merge_combiners, storage):
+    """
+    Group (key, value) pairs by key in a single pass.
+
+    If the combiners outgrow the memory budget, they are moved into
+    `NUM_BUCKETS` partitions by the hash of their keys, which are
+    spilled like any other partition. The buckets are then merged one
+    by one, so only the keys of one bucket are in memory at a time.
+
+    Parameters
+    ----------
+    dataset: Iterable
+        (key, value) pairs
+    create_combiner: value -> combiner
+        builds the accumulator from the first value of a key
+    merge_value: (combiner, value) -> combiner
+        folds the following values into the accumulator
+    merge_combiners: (combiner, combiner) -> combiner
+        merges two accumulators of the same key
+    storage: Storage
+        the memory budget
+
+    Returns
+    -------
+    Iterable
+        (key, combiner) pairs
+    """
+    combiners = {}
+    buckets = None
+    for key, value in dataset:
+        acc = combiners.get(key, _missing)
+        if acc is not _missing:
+            combiners[key] = merge_value(acc, value)
+            continue
+        combiners[key] = create_combiner(value)
+        if storage.limit and len(combiners) % CHUNK_SIZE == 0 \
+                and _dict_size(combiners) > storage.available():
+            if buckets is None:
+                buckets = [storage.partition() for _ in range(NUM_BUCKETS)]
+            _scatter(combiners.items(), buckets)
+            combiners = {}
+    if buckets is None:
+        return combiners.items()
+    _scatter(combiners.items(), buckets)
+    return _merge_buckets(buckets, merge_combiners)
+
+
+def _dict_size(combiners):
+    sample = list(islice(combiners.items(), SAMPLE_SIZE))
+    return sys.getsizeof(combiners) + estimate_size(sample) * len(combiners) // len(sample)
+
+
+def _scatter(pairs, buckets):
+    pairs = list(pairs)
+    routed = [[] for _ in buckets]
+    # the high bits, as the low ones decide which process the key is on
+    for h, pair in zip(hash_keys([pair[0] for pair in pairs]), pairs):
+        routed[(h >> 32) % len(buckets)].append(pair)
+    for bucket, items in zip(buckets, routed):
+        bucket.extend(items)
+
+
+def _merge_buckets(buckets, merge_combiners):
+    while buckets:
+        merged = {}
+        for key, combiner in buckets.pop(0):
+            acc = merged.get(key, _missing)
+            merged[key] = combiner if acc is _missing else merge_combiners(acc, combiner)
+        yield from merged.items()
+
+
+def external_sort(items, key=None, reverse=False, storage=None):
+    """
+    Sort the items within the memory budget of the storage.
+
+    The items are cut into runs as large as the memory left, every run
+    is sorted and spilled, and the runs are merged as a stream.
+
+    Returns
+    -------
+    Iterable
+        the sorted items
+    """
+    if storage is None or not storage.limit:
+        return sorted(items, key=key, reverse=reverse)
+    items = iter(items)
+    runs = []
+    run, size = [], 0
+    while 1:
+        chunk = list(islice(items, CHUNK_SIZE))
+        if chunk:
+            run.extend(chunk)
+            size += estimate_size(chunk)
+        if run and (not chunk or size > storage.available()):
+            run.sort(key=key, reverse=reverse)
+            if not chunk and not runs:
+                return run
+            partition = storage.partition(run)
+            partition.spill()
+            runs.append(partition)
+            run, size = [], 0
+        if not chunk:
+            break
+    return merge(*runs, key=key, reverse=reverse)
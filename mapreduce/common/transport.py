@@ -0,0 +1,151 @@
+"""
+Encoding of the batches sent between processes.
+
+A batch is pickled once with protocol 5, so that buffers such as numpy
+arrays are kept out of band instead of being copied into the pickle.
+Small batches go through the queue as bytes. For the batches larger than
+`CONFIG.SHM_THRESHOLD`, the pickle and its buffers are written into a
+shared memory segment and only a handle of the segment goes through the
+queue, skipping the pipe and the feeder thread of the queue. The
+smaller batches without buffers may be compressed, see `compression`.
+
+A segment is unlinked by the process that decodes (or releases) it,
+unless it is decoded by several processes, e.g. a broadcast.
+Segments that are never received are unlinked by the resource tracker
+when the processes exit, so nothing is left in /dev/shm.
+"""
+import pickle
+from collections import namedtuple
+from .settings import CONFIG
+from .compression import Compressor, Compressed, decompress
+
+try:
+    from multiprocess import shared_memory, resource_tracker
+except ImportError:
+    shared_memory = resource_tracker = None
+
+
+Packed = namedtuple('Packed', ['data', 'buffers'])
+Shared = namedtuple('Shared', ['name', 'sizes'])
+
+_compressor = None
+
+
+def compressor():
+    """The compressor of the batches of this process, see `compression`"""
+    global _compressor
+    if _compressor is None:
+        _compressor = Compressor(CONFIG.COMPRESSION, CONFIG.COMPRESSION_THRESHOLD)
+    return _compressor
+
+
+def ensure_tracker():
+    """
+    Start the resource tracker in this process, so that the processes
+    forked afterwards share it and a segment created by one process can
+    be unlinked by another without being reported as leaked.
+    """
+    if resource_tracker is not None:
+        resource_tracker.ensure_running()
+
+
+def encode(batch):
+    """
+    Returns
+    -------
+    Union[Packed, Shared, Compressed, list]
+        the message to put into a queue. The batch is returned unchanged
+        if it can only be pickled by dill, the queue takes care of it then.
+    """
+    buffers = []
+    try:
+        data = pickle.dumps(batch, protocol=5, buffer_callback=buffers.append)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        return batch
+    raws = [buffer.raw() for buffer in buffers]
+    size = len(data) + sum(raw.nbytes for raw in raws)
+    threshold = CONFIG.SHM_THRESHOLD
+    if shared_memory is None or not threshold or size < threshold:
+        if not raws:
+            compressed = compressor().compress(data)
+            if compressed is not None:
+                return compressed
+        # bytearrays, so that the arrays loaded from them are writable
+        return Packed(data, [bytearray(raw) for raw in raws])
+    segment = shared_memory.SharedMemory(create=True, size=size)
+    try:
+        sizes = [len(data)]
+        segment.buf[:len(data)] = data
+        offset = len(data)
+        for raw in raws:
+            segment.buf[offset:offset + raw.nbytes] = raw
+            offset += raw.nbytes
+            sizes.append(raw.nbytes)
+    except BaseException:
+        segment.close()
+        segment.unlink()
+        raise
+    segment.close()
+    return Shared(segment.name, sizes)
+
+
+def decode(message, unlink=True):
+    """
+    Parameters
+    ----------
+    message: Union[Packed, Shared, Compressed, list]
+        a message made by `encode`
+    unlink: bool
+        whether to unlink the shared memory segment after reading it,
+        otherwise the sender should `release` it afterwards
+
+    Returns
+    -------
+    object
+        the batch encoded in the message
+    """
+    if isinstance(message, Packed):
+        return pickle.loads(message.data, buffers=message.buffers)
+    if isinstance(message, Compressed):
+        return pickle.loads(decompress(message))
+    if isinstance(message, Shared):
+        segment = shared_memory.SharedMemory(name=message.name)
+        try:
+            offset = message.sizes[0]
+            data = bytes(segment.buf[:offset])
+            buffers = []
+            for size in message.sizes[1:]:
+                buffers.append(bytearray(segment.buf[offset:offset + size]))
+                offset += size
+        finally:
+            segment.close()
+            if unlink:
+                segment.unlink()
+        return pickle.loads(data, buffers=buffers)
+    return message
+
+
+def message_size(message):
+    """
+    Returns
+    -------
+    Optional[int]
+        the size in bytes of the batch encoded in the message, once
+        compressed if it is, or None if it is not known, i.e. it has
+        been left to the queue
+    """
+    if isinstance(message, Compressed):
+        return len(message.data)
+    if isinstance(message, Packed):
+        return len(message.data) + sum(len(buffer) for buffer in message.buffers)
+    if isinstance(message, Shared):
+        return sum(message.sizes)
+    return None
+
+
+def release(message):
+    """Free the resources held by a message without decoding it"""
+    if isinstance(message, Shared):
+        segment = shared_memory.SharedMemory(name=message.name)
+        segment.close()
+        segment.unlink()
@@ -0,0 +1,144 @@
+"""
+The server processes, which can be started ahead and reused by clients.
+"""
+import os
+import queue
+import atexit
+import random
+import threading
+import multiprocess
+from collections import namedtuple
+from multiprocess.connection import wait
+from .server import MRServer
+from .common.settings import CONFIG
+from .common.transport import ensure_tracker
+from .common.serialization import dumps_command
+
+Channel = namedtuple('Channel', ['queue', 'pipe', 'answers'])
+
+
+class WorkerPool:
+    """
+    The processes of a client. A pool given to `MRClient` is kept when
+    the client terminates, only its datasets are removed, so that the
+    next client given the pool starts at once, e.g. in tests or
+    short-lived tools. It is terminated by `terminate` once no client
+    uses it. A pool can be started ahead with `start`.
+
+    Parameters
+    ----------
+    num_cores: int
+        number of processes
+    method: Optional[str]
+        how to start the processes, 'fork', 'spawn' or 'forkserver', by
+        default the one of the platform. With 'forkserver' the processes
+        are forked from a server process that has imported this package
+        already, instead of copying the client, which may be large and
+        run threads.
+    """
+    def __init__(self, num_cores=None, method=None):
+        self.num_cores = num_cores or CONFIG.CORES
+        self.method = method
+        self.client = None      # the client using the processes
+        self.processes = []
+        self.channels = []
+        self.global_queue = None
+        self.stop = None
+        self.receiver = None
+
+    def start(self):
+        """Start the processes, unless they are running already"""
+        if self.processes:
+            return self
+        context = multiprocess.get_context(self.method)
+        if self.method == 'forkserver':
+            context.set_forkserver_preload(['mapreduce.client'])
+        ensure_tracker()
+        self.global_queue = context.Queue(CONFIG.COLLECT_BUFFER)
+        self.stop = context.Event()
+        # the settings of the client, which a spawned process does not inherit
+        CONFIG.update()
+        settings = dict(CONFIG.items())
+        seed = os.environ.get("PYTHONHASHSEED")
+        if seed is None and context.get_start_method() == 'spawn':
+            # the spawned processes share a hash seed, so that the keys hashed by
+            # the builtin `hash` go to the same partition, see `common.hashing`.
+            # The forked ones share the one of their parent already.
+            os.environ["PYTHONHASHSEED"] = str(random.randrange(1, 2 ** 32))
+        try:
+            self._start(context, settings)
+        finally:
+            if seed is None:
+                os.environ.pop("PYTHONHASHSEED", None)
+        atexit.register(self._exit)
+        return self
+
+    def _start(self, context, settings):
+        queues = [context.Queue() for _ in range(self.num_cores)]
+        steal_queues = [context.Queue() for _ in range(self.num_cores)]
+        for i in range(self.num_cores):
+            pipe_master, pipe_slave = context.Pipe()
+            process = MRServer(i, queues, pipe_slave, self.global_queue, self.stop,
+                               steal_queues, settings)
+            # start it by the method of the context rather than the default one
+            process._Popen = context.Process._Popen
+            self.channels.append(Channel(queues[i], pipe_master, queue.SimpleQueue()))
+            self.processes.append(process)
+            process.start()
+        self.receiver = threading.Thread(target=receive_answers, name="mapreduce-answers",
+                                         args=(self.channels, self.processes), daemon=True)
+        self.receiver.start()
+
+    def acquire(self, client):
+        """Start the processes if needed, and let `client` use them"""
+        if self.client is not None:
+            raise RuntimeError("The pool is used by another client")
+        self.start()
+        self.client = client
+
+    def release(self, client):
+        if self.client is client:
+            self.client = None
+
+    def terminate(self):
+        """Terminate the processes, once the client using them has terminated"""
+        if self.client is not None:
+            raise RuntimeError("The pool is used by a client")
+        data = dumps_command({'action': 'terminate'})
+        for channel in self.channels:
+            channel.pipe.send_bytes(data)
+        for channel in self.channels:
+            channel.answers.get()
+        for process in self.processes:
+            process.join()
+        self.receiver.join()
+        self.processes = []
+        self.channels = []
+        atexit.unregister(self._exit)
+
+    def _exit(self):
+        # the clients have terminated by now, as they registered later
+        if self.processes and self.client is None:
+            self.terminate()
+
+
+def receive_answers(channels, processes):
+    """
+    Move the answers of the processes from their pipes to the `answers`
+    of their channels, until the processes exit. The answers are read
+    as soon as they are sent, so that a process never waits for the
+    client to read them, while the client waits for the process to read
+    its next commands.
+    """
+    pipes = {channel.pipe: channel.answers for channel in channels}
+    sentinels = {process.sentinel: channel.pipe for process, channel in zip(processes, channels)}
+    while pipes:
+        for ready in wait(list(pipes) + list(sentinels)):
+            if ready in sentinels:
+                # the process has exited, after sending its last answers
+                pipe = sentinels.pop(ready)
+                answers = pipes.pop(pipe)
+                while pipe.poll():
+                    answers.put(pipe.recv())
+            elif ready in pipes:
+                pipes[ready].put(ready.recv())
@@ -1,122 +1,529 @@
-from multiprocess import Process, Queue
-from time import sleep
-from queue import Empty
-from inspect import isgeneratorfunction
-from functools import reduce
+import os
+import sys
+import time
+import cProfile
+import resource
+import traceback
+from multiprocess import Process
 from operator import itemgetter
+from itertools import chain, islice
+from functools import partial
+from bisect import bisect_left
+from random import Random
 from .common.settings import CONFIG
-from .common.itertools import bufferize
-from .common.io import robust_recv
+from .common.itertools import bufferize, make_batcher
+from .common.io import CLIENT, COUNTERS, StreamWriter, send_stream, recv_stream
+from .common.hashing import partition_keys
+from .common.storage import SPILL_PATH, Storage, combine, external_sort
+from .common.transport import decode
+from .common.arrays import np, check_array, select, partial_aggregate
+from .common.files import READERS, write_part
+from .common.stealing import WorkStealer
+from .common.serialization import FunctionCache, loads_command
+from .broadcast import BROADCASTS
+
+HASH_CHUNK_SIZE = 1024  # number of keys hashed at once in `partition`
+SKETCH_BATCH = 8192     # number of items fed into a sketch at once
+# the unit of `ru_maxrss` in bytes, it is kilobytes but on macOS
+RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+class RemoteError(RuntimeError):
+    """An exception raised by a command in a server process"""
+    def __init__(self, ith, trace):
+        super(RemoteError, self).__init__(ith, trace)
+        self.ith = ith
+        self.trace = trace
+
+    def __str__(self):
+        return "in process %d\n%s" % (self.ith, self.trace)
 
 
 class MRServer(Process):
-    def __init__(self, ith, queues, pipe, state, global_queue):
+    """
+    A worker process. It runs the commands received from its pipe
+    one by one, and answers every command through the pipe with its
+    result, or a `RemoteError` if it fails, along with the event
+    recorded for the command, see `common.stats`.
+
+    A command with `profile` set is run under cProfile, and the
+    event holds the stats of the profile.
+
+    `steal_queues` carry the messages of the work stealing between the
+    processes, see `common.stealing`. The `settings` of the client are
+    applied to `CONFIG` when the process starts.
+    """
+    def __init__(self, ith, queues, pipe, global_queue, stop, steal_queues, settings=None):
         self.ith = ith
         self.dataset = {}
         self.queues = queues
         self.queue = queues[ith]
+        self.backlog = []   # batches of the next streams received from the queue
+        self.steal_queues = steal_queues
+        self.rounds = 0     # number of commands run with work stealing so far
+        self.early = []     # messages of the next rounds of work stealing
+        self.idle = 0.0     # seconds spent waiting for work to steal so far
+        self.stolen = 0     # number of tasks stolen so far
+        self.sizes = {}     # the sizes of the datasets reported to the client so far
+        self.settings = settings or {}
         self.pipe = pipe
-        self.state = state
         self.global_queue = global_queue
+        self.stop = stop
+        self.records_in = 0     # number of items read from the datasets so far
         self.__to_terminate = False
         super(MRServer, self).__init__()
 
     def run(self):
-        while not self.__to_terminate:
-            command = self.pipe.recv()
-            self.state.value = 1
-            func_name = command.pop('action')
-            func = getattr(self, func_name)
-            func(**command)
-            self.state.value = 0
+        for key, value in self.settings.items():
+            CONFIG.set_value(key, value)
+        path = os.path.join(SPILL_PATH, "%d-%d" % (os.getpid(), self.ith))
+        self.storage = Storage(CONFIG.MEMORY_LIMIT * 2 ** 20, path)
+        self.functions = FunctionCache()
+        try:
+            while not self.__to_terminate:
+                data = self.pipe.recv_bytes()
+                before = self._counters()
+                start, cpu = time.time(), time.process_time()
+                profiler = None
+                try:
+                    command = loads_command(data, self.functions)
+                    func = getattr(self, command.pop('action'))
+                    if command.pop('profile', False):
+                        profiler = cProfile.Profile()
+                        reply = profiler.runcall(func, **command)
+                    else:
+                        reply = func(**command)
+                except Exception:
+                    reply = RemoteError(self.ith, traceback.format_exc())
+                event = self._event(before, start, cpu, profiler)
+                event['failed'] = isinstance(reply, RemoteError)
+                self.pipe.send((reply, event))
+        finally:
+            self.dataset.clear()
+            self.storage.close()
+
+    def _counters(self):
+        return dict(COUNTERS, records_in=self.records_in, records_out=self.storage.records,
+                    spilled=self.storage.spilled, function_hits=self.functions.hits,
+                    function_misses=self.functions.misses, idle=self.idle,
+                    stolen=self.stolen)
+
+    def _event(self, before, start, cpu, profiler=None):
+        """The event of the command started at `start`, see `common.stats`"""
+        after = self._counters()
+        event = {key: after[key] - before[key] for key in after}
+        event.update(ith=self.ith, start=start, duration=time.time() - start,
+                     cpu=time.process_time() - cpu, memory=self.storage.nbytes,
+                     peak_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT)
+        if CONFIG.CACHE_LIMIT:
+            event['datasets'] = self._changed_sizes()
+        if profiler is not None:
+            profiler.create_stats()
+            event['profile'] = profiler.stats
+        return event
+
+    def _changed_sizes(self):
+        """The sizes of the datasets changed since the last event, None for the removed ones"""
+        changed = {name: None for name in self.sizes if name not in self.dataset}
+        for name, data in self.dataset.items():
+            if self.sizes.get(name) != data.size:
+                changed[name] = data.size
+        for name, size in changed.items():
+            if size is None:
+                del self.sizes[name]
+            else:
+                self.sizes[name] = size
+        return changed
 
     def terminate(self):
         self.__to_terminate = True
 
-    def add_dataset(self, name):
+    def add_dataset(self, name, senders=(CLIENT,)):
         if name not in self.dataset:
-            self.dataset[name] = []
-        for item in robust_recv(self.global_queue, retries=3):
+            self.dataset[name] = self.storage.partition()
+        for item in recv_stream(self.queue, senders, self.backlog):
             self.dataset[name].extend(item)
 
-    def collect(self, name):
-        for batch in bufferize(self.dataset[name], CONFIG.BUFFER_SIZE):
-            self.global_queue.put(batch)
+    def collect(self, name, stages=(), limit=None):
+        batcher = make_batcher()
+        def batches():
+            # inside the stream, so that it is closed even if `name` is missing
+            data = self.iterate(name, stages)
+            if limit is not None:
+                data = islice(data, limit)
+            yield from batcher.batches(data)
+        send_stream(self.global_queue, self.ith, batches(), stop=self.stop, batcher=batcher)
+
+    def add_array(self, name):
+        chunks = list(recv_stream(self.queue, (CLIENT,), self.backlog))
+        array = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+        self.dataset[name] = self.storage.array(array)
+
+    def read_files(self, name, ranges, format, options):
+        """
+        Read the byte ranges of the files assigned to this process,
+        see `common.files.split_ranges`.
+        """
+        def records():
+            for path, start, end in ranges[self.ith]:
+                yield from READERS[format](path, start, end, **options)
+        self.dataset[name] = self.storage.partition(records())
+
+    def save(self, name, directory, format, stages=(), compression=None, options=None):
+        """
+        Returns
+        -------
+        Tuple[str, int]
+            the path of the file written and the number of items
+        """
+        if format == 'npy':
+            data = self._array(name)
+        else:
+            data = self.iterate(name, stages)
+        return write_part(directory, self.ith, format, data, compression, **(options or {}))
+
+    def collect_array(self, name):
+        def batches():
+            yield self._array(name)
+        send_stream(self.global_queue, self.ith, batches(), stop=self.stop)
+
+    def map_array(self, src, dest, func, with_index=False):
+        if with_index:
+            func = partial(func, self.ith)
+        array = np.asarray(func(self._array(src)))
+        check_array(array)
+        self.dataset[dest] = self.storage.array(array)
+
+    def filter_mask(self, src, dest, func):
+        array = self._array(src)
+        mask = np.asarray(func(array), dtype=bool)
+        self.dataset[dest] = self.storage.array(array[mask])
+
+    def sum_array(self, name, column=None):
+        return select(self._array(name), column).sum(axis=0)
+
+    def group_aggregate(self, name, key, value, how):
+        array = self._array(name)
+        return partial_aggregate(select(array, key), select(array, value), how)
+
+    def reset(self):
+        """Remove all the datasets"""
+        self.dataset.clear()
 
     def remove_dataset(self, name):
-        del self.dataset[name]
+        # it may have been evicted already, see `MRClient._send`
+        self.dataset.pop(name, None)
+
+    def add_broadcast(self, id, message):
+        BROADCASTS[id] = decode(message, unlink=False)
 
-    def filter(self, src, dest, func):
-        self.dataset[dest] = list(filter(func, self.dataset[src]))
+    def remove_broadcast(self, ids):
+        for id in ids:
+            BROADCASTS.pop(id, None)
 
-    def flatmap(self, src, dest, func):
-        src = self.dataset[src]
-        self.dataset[dest] = []
-        for item in src:
-            self.dataset[dest].extend(list(func(item)))
+    def _array(self, name):
+        """The array of this process of a dataset of arrays"""
+        self.records_in += len(self.dataset[name])
+        return self.dataset[name].array
+
+    def iterate(self, name, stages=()):
+        """
+        Stream the dataset through a chain of narrow operations.
+
+        Parameters
+        ----------
+        name: str
+            the materialized dataset to read from
+        stages: Sequence[Tuple[str, callable]]
+            (action, func) pairs, where action is one of `NARROW_OPERATIONS`
+        """
+        data = iter(self.dataset[name])
+        self.records_in += len(self.dataset[name])
+        return self._apply(data, stages)
+
+    def _apply(self, data, stages):
+        for action, func in stages:
+            if action in INDEXED_OPERATIONS:
+                func = partial(func, self.ith)
+            data = NARROW_OPERATIONS[action](func, data)
+        return data
+
+    def foreach_partition(self, name, func, stages=(), with_index=False):
+        data = self.iterate(name, stages)
+        result = func(self.ith, data) if with_index else func(data)
+        if result is not None:
+            # run the functions that yield
+            for _ in result:
+                pass
+
+    def persist(self, src, dest, stages=(), balance=False):
+        """
+        Store the dataset after the chain of narrow operations. If
+        `balance`, the items are split into tasks, and the processes
+        that run out of tasks steal them from the others, see
+        `common.stealing`. The result of a task is stored by the
+        process that runs it.
+        """
+        if not balance:
+            self.dataset[dest] = self.storage.partition(self.iterate(src, stages))
+            return
+        def items():
+            # inside the stealer, so that it takes part even if `src` is missing
+            yield from self.iterate(src)
+        dataset = self.storage.partition()
+        self.rounds += 1
+        stealer = WorkStealer(self.ith, self.steal_queues, self.rounds, self.early)
+        try:
+            stealer.run(items(), lambda task: dataset.extend(self._apply(task, stages)))
+        finally:
+            self.idle += stealer.idle
+            self.stolen += stealer.stolen
+        self.dataset[dest] = dataset
 
-    def map(self, src, dest, func):
-        self.dataset[dest] = list(map(func, self.dataset[src]))
+    def partition(self, src, dest, by=None, stages=(), boundaries=None, ascending=True,
+                  hot=None, replicate=False):
+        """
+        Send every item to the process its key belongs to, and
+        receive the items of this process from all the others.
 
-    def partition(self, name, by=None):
+        The process of a key is decided by its hash, or by the range
+        it falls in if `boundaries` is given, see `range_partition`.
+        The items of the `hot` keys go to the processes of their key
+        in turn, or to all of them if `replicate`, see `spread_keys`.
+        """
         by = by or itemgetter(0)
         n = len(self.queues)
-        dataset = self.dataset.pop(name)
+        dataset = self.iterate(src, stages)
+        if src == dest:
+            del self.dataset[src]
+        batcher = make_batcher(spread=n)
+        writers = [StreamWriter(queue, self.ith, batcher) for queue in self.queues]
         buffers = [[] for _ in range(n)]
-        for item in dataset:
-            key = Hash.hash(by(item)) % n
-            buffers[key].append(item)
-            if len(buffers[key]) >= CONFIG.BUFFER_SIZE:
-                self.queues[key].put(buffers[key])
-                buffers[key] = []
-        for i in range(n):
-            if buffers[i]:
-                self.queues[i].put(buffers[i])
-
-    def copy(self, src, dest):
-        self.dataset[dest] = self.dataset[src].copy()
-
-    def reduce(self, src, dest, func):
-        dataset = self.dataset[src]
-        keys = set(item[0] for item in dataset)
-        newdata = []
-        for key in keys:
-            group = (item[1] for item in dataset if item[0] == key)
-            newdata.append((key, reduce(func, group)))
-        self.dataset[dest] = newdata
-
-    def count(self, name):
-        self.pipe.send(len(self.dataset[name]))
+        turns = {}
+        try:
+            for chunk in bufferize(dataset, HASH_CHUNK_SIZE):
+                keys = [by(item) for item in chunk]
+                if boundaries is None:
+                    parts = partition_keys(keys, n)
+                else:
+                    parts = range_partition(keys, boundaries, ascending)
+                pairs = zip(parts, chunk)
+                if hot:
+                    pairs = spread_keys(keys, pairs, hot, replicate, turns, self.ith)
+                for part, item in pairs:
+                    buffers[part].append(item)
+                    if len(buffers[part]) >= batcher.size:
+                        writers[part].put(buffers[part])
+                        buffers[part] = []
+            for i in range(n):
+                if buffers[i]:
+                    writers[i].put(buffers[i])
+        finally:
+            for writer in writers:
+                writer.close()
+            # drain the streams of the others even if sending failed,
+            # so that nothing is left in the queue for the next command
+            self.dataset[dest] = self.storage.partition()
+            self.add_dataset(dest, senders=range(n))
+
+    def sample_keys(self, name, by, size, stages=()):
+        """
+        Returns
+        -------
+        Tuple[int, list]
+            the number of items, and the keys of `size` items
+            sampled uniformly from them
+        """
+        rng = Random(self.ith)
+        sample = []
+        n = 0
+        for n, item in enumerate(self.iterate(name, stages), 1):
+            if len(sample) < size:
+                sample.append(by(item))
+            else:
+                i = rng.randrange(n)
+                if i < size:
+                    sample[i] = by(item)
+        return n, sample
+
+    def sketch(self, name, sketch, stages=()):
+        """
+        Returns
+        -------
+        object
+            the empty `sketch` fed with the items, see `common.sketches`
+        """
+        sketch.reseed(self.ith)
+        for batch in bufferize(self.iterate(name, stages), SKETCH_BATCH):
+            sketch.update(batch)
+        return sketch
+
+    def sort(self, src, dest, key, ascending=True, stages=()):
+        data = external_sort(self.iterate(src, stages), key, not ascending, self.storage)
+        self.dataset[dest] = self.storage.partition(data)
+
+    def hash_join(self, src, dest, how='inner', right=None, table=None, stages=()):
+        """
+        Hash join the (key, value) pairs of `src` with the ones of `right`,
+        or with the ones in the `table` broadcast to every process.
+
+        Parameters
+        ----------
+        how: str
+            'inner' or 'left'
+        """
+        if table is None:
+            self.records_in += len(self.dataset[right])
+            table = group_by_key(self.dataset[right])
+        else:
+            table = group_by_key(table.value)
+        data = join_pairs(self.iterate(src, stages), table, how)
+        self.dataset[dest] = self.storage.partition(data)
+
+    def cogroup(self, left, right, dest):
+        groups = {}
+        self.records_in += len(self.dataset[left]) + len(self.dataset[right])
+        for key, value in self.dataset[left]:
+            groups.setdefault(key, ([], []))[0].append(value)
+        for key, value in self.dataset[right]:
+            groups.setdefault(key, ([], []))[1].append(value)
+        self.dataset[dest] = self.storage.partition(groups.items())
+
+    def reduce(self, src, dest, func, stages=()):
+        data = combine(self.iterate(src, stages), identity, func, func, self.storage)
+        self.dataset[dest] = self.storage.partition(data)
+
+    def combine_by_key(self, src, dest, create_combiner, merge_value, merge_combiners, stages=()):
+        data = combine(self.iterate(src, stages), create_combiner, merge_value,
+                       merge_combiners, self.storage)
+        self.dataset[dest] = self.storage.partition(data)
+
+    def count(self, name, stages=()):
+        if stages:
+            n = sum(1 for _ in self.iterate(name, stages))
+        else:
+            n = len(self.dataset[name])
+        return n
 
     def merge(self, src, dest):
-        dataset = []
-        for s in src:
-            dataset.extend(self.dataset[s])
+        dataset = self.storage.partition()
+        for name, stages in src:
+            dataset.extend(self.iterate(name, stages))
         self.dataset[dest] = dataset
 
 
-class Hash:
-    @staticmethod
-    def hash_string(s):
-        if not s:
-            return 0 # empty
-        value = ord(s[0]) << 7
-        for char in s:
-            value = Hash.c_mul(1000003, value) ^ ord(char)
-        value = value ^ len(s)
-        if value == -1:
-            value = -2
-        return value
-
-    @staticmethod
-    def c_mul(a, b):
-        return int(hex((a * b) & 0xFFFFFFFF)[:-1], 16)
-
-    @staticmethod
-    def hash(obj):
-        if isinstance(obj, str):
-            return Hash.hash_string(obj)
+def flatmap(func, iterable):
+    return chain.from_iterable(map(func, iterable))
+
+
+def map_partitions(func, iterable):
+    result = func(iterable)
+    return iter(()) if result is None else iter(result)
+
+
+NARROW_OPERATIONS = {
+    'map': map,
+    'filter': filter,
+    'flatmap': flatmap,
+    'map_partitions': map_partitions,
+    'map_partitions_with_index': map_partitions,
+}
+# the operations whose function also gets the index of the process
+INDEXED_OPERATIONS = {'map_partitions_with_index'}
+
+
+def range_partition(keys, boundaries, ascending=True):
+    """
+    Parameters
+    ----------
+    keys: list
+        the keys to partition
+    boundaries: list
+        n - 1 sorted keys, keys up to (and including) the i-th
+        boundary go to the i-th partition
+    ascending: bool
+        if False, the partitions are numbered from the largest keys
+
+    Returns
+    -------
+    list
+        the partition in range(n) of every key
+    """
+    parts = [bisect_left(boundaries, key) for key in keys]
+    if not ascending:
+        last = len(boundaries)
+        parts = [last - part for part in parts]
+    return parts
+
+
+def spread_keys(keys, pairs, hot, replicate, turns, start=0):
+    """
+    Parameters
+    ----------
+    keys: list
+        the key of every item
+    pairs: Iterable[Tuple[int, object]]
+        the partition of every item, and the item
+    hot: Dict[object, List[int]]
+        the partitions of the hot keys
+    replicate: bool
+        whether to send the items of a hot key to all its partitions,
+        instead of one of them in turn
+    turns: dict
+        the number of items of every hot key seen so far
+    start: int
+        the turn of the first item of a key
+
+    Yields
+    ------
+    Tuple[int, object]
+        the partition of every item, and the item
+    """
+    for key, (part, item) in zip(keys, pairs):
+        parts = hot.get(key)
+        if parts is None:
+            yield part, item
+        elif replicate:
+            for part in parts:
+                yield part, item
         else:
-            return obj
+            turn = turns.get(key, start)
+            turns[key] = turn + 1
+            yield parts[turn % len(parts)], item
+
+
+def group_by_key(pairs):
+    groups = {}
+    for key, value in pairs:
+        groups.setdefault(key, []).append(value)
+    return groups
+
+
+def join_pairs(pairs, table, how='inner'):
+    """
+    Parameters
+    ----------
+    pairs: Iterable
+        (key, value) pairs to probe the table with
+    table: dict
+        the values of the other side grouped by key
+    how: str
+        'inner' or 'left', whether to keep the pairs without a match
+
+    Yields
+    ------
+    Tuple[object, Tuple[object, object]]
+        (key, (value, other value)) pairs, the other value of a pair
+        without a match is None
+    """
+    for key, value in pairs:
+        matches = table.get(key)
+        if matches:
+            for match in matches:
+                yield key, (value, match)
+        elif how == 'left':
+            yield key, (value, None)
 
 
+def identity(x):
+    return x
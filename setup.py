@@ -13,8 +13,11 @@ def resolve_requirements():
 setup_args = dict(
     name='pymr',
     version=version,
-    packages=find_packages(exclude=["*.test", "*.test.*", "test.*", "test", "script", "private"]),
+    packages=find_packages(exclude=["*.test", "*.test.*", "test.*", "test", "tests", "tests.*",
+                                    "script", "private"]),
     install_requires=resolve_requirements(),
+    # pickle protocol 5 and shared_memory
+    python_requires='>=3.8',
     include_package_data=True,
     # scripts=["scripts/quantlib"],
     url='',
@@ -25,8 +28,11 @@ setup_args = dict(
     classifiers=[
         'Programming Language :: Python',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
         'License :: OSI Approved :: GNU License',
 
         'Operating System :: POSIX',
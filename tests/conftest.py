@@ -0,0 +1,10 @@
+import pytest
+
+from mapreduce import MRClient
+
+
+@pytest.fixture(scope="module")
+def client():
+    client = MRClient(2)
+    yield client
+    client.terminate()
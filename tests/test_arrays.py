@@ -0,0 +1,21 @@
+import numpy as np
+
+
+def double(chunk):
+    chunk *= 2
+    return chunk
+
+
+def test_map_array_in_place(client):
+    data = client.distribute_array("array", np.arange(1000, dtype=np.float64))
+    data.map_partitions(double)
+    result = data.collect()
+    assert result.flags.writeable
+    np.testing.assert_array_equal(result, np.arange(0, 2000, 2, dtype=np.float64))
+
+
+def test_collected_arrays_writable(client):
+    data = client.distribute("arrays", [np.ones(10) for _ in range(8)])
+    for array in data.collect():
+        array += 1
+        assert (array == 2).all()
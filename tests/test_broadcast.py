@@ -0,0 +1,36 @@
+import os
+import sys
+import subprocess
+
+# the example of the README, run as a script
+SCRIPT = """
+from mapreduce import MRClient
+
+if __name__ == '__main__':
+    client = MRClient(2)
+    data = client.distribute('d', [0, 1, 2])
+    table = client.broadcast({0: 'a', 1: 'b', 2: 'c'})
+    names = data.map(lambda x: table.value[x], inplace=False).collect()
+    table.unpersist()
+    print(sorted(names), sorted(data.collect()))
+    client.terminate()
+"""
+
+
+def test_broadcast_in_main(tmp_path):
+    script = tmp_path / "script.py"
+    script.write_text(SCRIPT)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    path = os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")]))
+    env = dict(os.environ, PYTHONPATH=path)
+    output = subprocess.run([sys.executable, str(script)], env=env, check=True, timeout=120,
+                            stdout=subprocess.PIPE, universal_newlines=True).stdout
+    assert output.strip() == "['a', 'b', 'c'] [0, 1, 2]"
+
+
+def test_broadcast(client):
+    table = client.broadcast({i: i * i for i in range(10)})
+    data = client.distribute("broadcast", list(range(10)))
+    assert sorted(data.map(lambda x: table.value[x], inplace=False).collect()) == \
+        [i * i for i in range(10)]
+    table.unpersist()
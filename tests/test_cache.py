@@ -0,0 +1,50 @@
+from operator import add
+
+import pytest
+
+from mapreduce import MRClient, CONFIG
+from mapreduce.server import RemoteError
+
+
+@pytest.fixture
+def cached_client():
+    limit = CONFIG.CACHE_LIMIT
+    CONFIG.CACHE_LIMIT = 1
+    client = MRClient(2)
+    yield client
+    client.terminate()
+    CONFIG.CACHE_LIMIT = limit
+
+
+def word_counts(client, path):
+    path.write_text("".join("w%d\n" % (i % 1000) for i in range(20000)))
+    lines = client.read_text(str(path))
+    return lines.map(lambda line: (line, 1), inplace=False).reduce(add, inplace=False)
+
+
+def fill(client):
+    big = [client.distribute("big%d" % i, list(range(100000))).wait() for i in range(3)]
+    # the sizes are known once answered, the next command evicts
+    client.distribute("small", [0]).wait()
+    return big
+
+
+def test_evict_and_recompute(cached_client, tmp_path):
+    counts = word_counts(cached_client, tmp_path / "words.txt")
+    expected = sorted(counts.collect())
+    big = fill(cached_client)
+    assert counts.name in cached_client.lineage.evicted
+    assert sorted(counts.collect()) == expected
+    assert cached_client.cache_counters['recomputed'] >= 1
+    assert sum(data.count() for data in big) == 300000
+
+
+def test_recompute_failure(cached_client, tmp_path):
+    path = tmp_path / "words.txt"
+    counts = word_counts(cached_client, path)
+    counts.wait()
+    fill(cached_client)
+    assert counts.name in cached_client.lineage.evicted
+    path.unlink()
+    with pytest.raises(RemoteError, match="FileNotFoundError"):
+        counts.collect()
@@ -0,0 +1,7 @@
+def test_wait_and_idle(client):
+    data = client.distribute("client", list(range(100)))
+    client.wait(queue=False)
+    assert client.idle(True) and client.idle(queue=False)
+    with client.acquire():
+        assert client.idle()
+    assert data.count() == 100
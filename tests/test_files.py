@@ -0,0 +1,55 @@
+import gzip
+
+import pytest
+
+from mapreduce.common import files
+
+LINES = ["line %d %s" % (i, "x" * (i % 7)) for i in range(200)]
+
+
+@pytest.fixture
+def small_blocks(monkeypatch):
+    monkeypatch.setattr(files, "BLOCK_SIZE", 16)
+
+
+def read_ranges(path, n):
+    lines = []
+    for ranges in files.split_ranges([path], n):
+        for path, start, end in ranges:
+            lines.extend(files.read_text(path, start, end))
+    return lines
+
+
+@pytest.mark.parametrize("n", [1, 3, 7])
+def test_read_text_crlf(tmp_path, small_blocks, n):
+    path = tmp_path / "crlf.txt"
+    path.write_bytes("\r\n".join(LINES).encode() + b"\r\n")
+    assert read_ranges(str(path), n) == LINES
+
+
+def test_read_text_crlf_compressed(tmp_path, small_blocks):
+    path = tmp_path / "crlf.txt.gz"
+    with gzip.open(str(path), "wb") as file:
+        file.write("\r\n".join(LINES).encode() + b"\r\n")
+    assert read_ranges(str(path), 3) == LINES
+
+
+def test_read_text(client, tmp_path):
+    path = tmp_path / "lines.txt"
+    path.write_text("\n".join(LINES) + "\n")
+    assert sorted(client.read_text(str(path)).collect()) == sorted(LINES)
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_save_as_text_pairs(client, tmp_path, compression):
+    items = [(i, "v%d" % i) for i in range(50)] + [("x",)]
+    client.distribute("pairs", items).save_as_text(str(tmp_path), compression=compression)
+    lines = client.read_text(str(tmp_path)).collect()
+    assert sorted(lines) == sorted(str(item) for item in items)
+
+
+def test_save_as_jsonl(client, tmp_path):
+    items = [{"key": i, "value": [i, i * 2]} for i in range(50)]
+    client.distribute("objects", items).save_as_jsonl(str(tmp_path))
+    objects = client.read_jsonl(str(tmp_path)).collect()
+    assert sorted(objects, key=lambda obj: obj["key"]) == items
@@ -0,0 +1,37 @@
+import gc
+import weakref
+
+from mapreduce import MRClient
+
+
+def test_map_in_place(client):
+    data = client.distribute("narrow", list(range(10)))
+    data.map(lambda x: x * 2)
+    assert sorted(data.collect()) == list(range(0, 20, 2))
+    data.filter(lambda x: x % 4 == 0).flatmap(lambda x: [x, x])
+    assert sorted(data.collect()) == [0, 0, 4, 4, 8, 8, 12, 12, 16, 16]
+
+
+def test_map_in_place_keeps_earlier_datasets(client):
+    data = client.distribute("narrow_earlier", list(range(10)))
+    doubled = data.map(lambda x: x * 2, inplace=False)
+    data.map(lambda x: -x)
+    assert sorted(doubled.collect()) == list(range(0, 20, 2))
+    assert sorted(data.collect()) == list(range(-9, 1))
+
+
+def test_map_not_in_place(client):
+    data = client.distribute("narrow_copy", list(range(10)))
+    squares = data.map(lambda x: x * x, inplace=False)
+    assert sorted(squares.collect()) == [x * x for x in range(10)]
+    assert sorted(data.collect()) == list(range(10))
+
+
+def test_terminated_client_collected():
+    client = MRClient(1)
+    client.distribute("narrow_client", [1, 2]).map(lambda x: x).collect()
+    ref = weakref.ref(client)
+    client.terminate()
+    del client
+    gc.collect()
+    assert ref() is None
@@ -0,0 +1,43 @@
+from operator import add
+
+WORDS = "a fox is chasing after a rabbit chased by a fox".split(" ")
+
+
+def test_distribute_collect(client):
+    data = client.distribute("items", list(range(1000)))
+    assert sorted(data.collect()) == list(range(1000))
+    assert data.count() == 1000
+    assert len(data.take(10)) == 10
+
+
+def test_word_count(client):
+    data = client.distribute("words", WORDS)
+    counts = data.map(lambda x: (x, 1), inplace=False).reduce2(add)
+    assert dict(counts.collect()) == {"a": 3, "fox": 2, "is": 1, "chasing": 1, "after": 1,
+                                      "rabbit": 1, "chased": 1, "by": 1}
+
+
+def test_aggregate_by_key(client):
+    pairs = client.distribute("pairs_mean", [(i % 3, i) for i in range(30)])
+    sums = pairs.aggregate_by_key((0, 0),
+                                  lambda acc, v: (acc[0] + v, acc[1] + 1),
+                                  lambda a, b: (a[0] + b[0], a[1] + b[1]),
+                                  inplace=False)
+    assert dict(sums.collect()) == {0: (135, 10), 1: (145, 10), 2: (155, 10)}
+
+
+def test_join(client):
+    left = client.distribute("left", [(i, "l%d" % i) for i in range(10)])
+    right = client.distribute("right", [(i, "r%d" % i) for i in range(5, 15)])
+    expected = [(i, ("l%d" % i, "r%d" % i)) for i in range(5, 10)]
+    assert sorted(left.join(right).collect()) == expected
+    assert sorted(left.join(right, broadcast=True).collect()) == expected
+    assert len(left.left_join(right).collect()) == 10
+
+
+def test_sketches(client):
+    data = client.distribute("sketched", [i % 100 for i in range(10000)])
+    assert abs(data.count_approx_distinct() - 100) <= 5
+    assert data.top_k(1)[0][1] >= 100
+    low, high = data.approx_quantiles([0, 1])
+    assert (low, high) == (0, 99)
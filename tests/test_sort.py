@@ -0,0 +1,20 @@
+import pytest
+
+from mapreduce.server import RemoteError
+
+
+def test_sort_by_key(client):
+    data = client.distribute("sort", [5, 3, 9, 1, 7, 2])
+    assert data.sort_by_key(key=lambda x: x, inplace=False).collect() == [1, 2, 3, 5, 7, 9]
+    assert data.sort_by_key(key=lambda x: x, ascending=False).collect() == [9, 7, 5, 3, 2, 1]
+
+
+def test_sort_by_key_failing_key(client):
+    def key(x):
+        if x == 4321:
+            raise ValueError("bad key")
+        return x
+
+    data = client.distribute("sort_failing", list(range(5001)))
+    with pytest.raises(RemoteError):
+        data.sort_by_key(key=key).collect()